@@ -0,0 +1,145 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from resources import resources
+from web_retriever import corpus_version
+
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class SemanticAnswerCache(object):
+    """
+    Cache of final graph results keyed on the question embedding
+
+    A lookup returns the stored generation and documents of the most similar cached
+    question when its cosine similarity is above the threshold. Entries expire after
+    ttl seconds, the least recently used entry is evicted beyond max_size, and the
+    whole cache is dropped when the web_retriever corpus changes.
+    """
+
+    def __init__(self, embeddings, threshold=0.95, ttl=60 * 60, max_size=256, version_fn=corpus_version):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version_fn = version_fn
+        self.version = version_fn() if version_fn else None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self.version:
+            # 인덱스가 바뀌면 저장된 답변의 근거도 달라지므로 전부 버린다
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.version = version
+
+    def _expire(self, now):
+        for key in [k for k, e in self.entries.items() if now - e["created_at"] > self.ttl]:
+            del self.entries[key]
+            self.expirations += 1
+
+    def lookup(self, question):
+        """
+        Find a cached result for a near-duplicate question
+
+        Args:
+            question (str): The user question
+
+        Returns:
+            tuple: ({"generation", "documents", "question", "similarity"} or None on a miss,
+                question embedding to pass to store())
+        """
+        vector = self.embeddings.embed_query(question)
+        with self.lock:
+            self._check_version()
+            self._expire(time.time())
+
+            best_key, best_score = None, self.threshold
+            for key, entry in self.entries.items():
+                score = cosine_similarity(vector, entry["vector"])
+                if score >= best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None:
+                self.misses += 1
+                return None, vector
+
+            self.hits += 1
+            self.entries.move_to_end(best_key)
+            entry = self.entries[best_key]
+            return {
+                "question": entry["question"],
+                "generation": entry["generation"],
+                "documents": list(entry["documents"]),
+                "similarity": best_score,
+            }, vector
+
+    def store(self, question, result, vector=None):
+        """
+        Store the final state of a graph run; failed and unhelpful generations are not cached
+
+        Args:
+            question (str): The user question
+            result (dict): Final state containing generation and documents
+            vector (list): Question embedding returned by lookup(), embedded again when None
+        """
+        if not result or not isinstance(result, dict):
+            return
+        generation = result.get("generation")
+        if not generation or generation.startswith("failed") or result.get("useful") == "No":
+            return
+
+        if vector is None:
+            vector = self.embeddings.embed_query(question)
+        with self.lock:
+            self._check_version()
+            self.entries[question] = {
+                "question": question,
+                "vector": vector,
+                "generation": generation,
+                "documents": list(result.get("documents", [])),
+                "created_at": time.time(),
+            }
+            self.entries.move_to_end(question)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self.entries),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+def build_answer_cache(embeddings=None, **kwargs):
+    if embeddings is None:
+        embeddings = resources.get("embeddings")
+    return SemanticAnswerCache(embeddings, **kwargs)
@@ -0,0 +1,228 @@
+"""
+Batch runner over the compiled workflow
+
+Runs a JSONL file (or any iterable) of questions through the graph with bounded
+concurrency and appends one JSON line per finished question to the output file.
+Questions already answered in the output are skipped, so an interrupted run is
+resumed by running the same command again.
+
+    python batch_run.py questions.jsonl results.jsonl --concurrency 16
+
+Input lines are {"id": ..., "question": ...} objects or plain question text.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+from resources import resources
+from user_langgraph import initial_state
+import web_retriever
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Embeddings wrapper coalescing concurrent embed_query calls into one embed_documents call
+
+    Queries arriving within max_wait seconds of each other (up to max_batch) are embedded
+    together, so the retrieve node of many in-flight questions costs one API round-trip.
+    """
+
+    def __init__(self, inner, max_batch=64, max_wait=0.02):
+        self.inner = inner
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.pending = []
+        self.timer = None
+        self.batches = 0
+
+    def _flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not pending:
+            return
+        self.batches += 1
+        try:
+            vectors = self.inner.embed_documents([text for text, _ in pending])
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(pending, vectors):
+            future.set_result(vector)
+
+    def embed_query(self, text):
+        future = Future()
+        with self.lock:
+            self.pending.append((text, future))
+            full = len(self.pending) >= self.max_batch
+            if not full and self.timer is None:
+                self.timer = threading.Timer(self.max_wait, self._flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self._flush()
+        return future.result()
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+
+def question_id(question):
+    return hashlib.sha256(question.encode("utf-8")).hexdigest()[:16]
+
+
+def read_questions(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                item = line
+            yield item
+
+
+def normalize(item):
+    """
+    Raises:
+        ValueError: item is neither question text nor an object with a string "question"
+    """
+    if isinstance(item, str):
+        return {"id": question_id(item), "question": item}
+    if not isinstance(item, dict) or not isinstance(item.get("question"), str):
+        raise ValueError(f"expected question text or an object with a 'question' string, got {item!r}")
+    item = dict(item)
+    item.setdefault("id", question_id(item["question"]))
+    return item
+
+
+def completed_ids(output_path):
+    # 에러 없이 끝난 질문만 완료로 본다 (실패한 질문은 재시작 시 다시 실행)
+    # 잘못된 입력 줄의 기록("input"이 있음)은 다시 실행해도 같은 에러라 완료로 본다
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 비정상 종료로 마지막 줄이 잘렸을 수 있다
+                continue
+            if not record.get("error") or "input" in record:
+                done.add(record["id"])
+    return done
+
+
+def to_record(item, result, latency, error):
+    documents = []
+    for doc in (result or {}).get("documents", []):
+        documents.append({
+            "title": doc.metadata.get("title"),
+            "url": doc.metadata.get("url"),
+            "score": doc.metadata.get("score"),
+        })
+    return dict(item, generation=(result or {}).get("generation"), documents=documents,
+                latency=round(latency, 3), error=error)
+
+
+async def arun_batch(questions, output_path, concurrency=8, app=None):
+    """
+    Run questions through the graph and stream results to a JSONL file
+
+    Args:
+        questions (iterable): question strings or {"id", "question", ...} dicts
+        output_path (str): JSONL file results are appended to
+        concurrency (int): Maximum number of questions in flight
+        app (CompiledGraph): compiled workflow, resources.get("app") by default
+
+    Returns:
+        dict: counts of processed, skipped and failed questions
+    """
+    app = app or resources.get("app")
+    done = completed_ids(output_path)
+    stats = {"processed": 0, "skipped": 0, "failed": 0}
+    items = iter(questions)
+    lock = asyncio.Lock()
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        async def worker():
+            while True:
+                # 모든 질문을 미리 읽지 않고 worker가 하나씩 가져간다
+                async with lock:
+                    item = next(items, None)
+                    if item is None:
+                        return
+                    try:
+                        item = normalize(item)
+                    except ValueError as e:
+                        # 잘못된 줄은 에러로 남기고 나머지 질문은 계속 처리한다
+                        raw = json.dumps(item, ensure_ascii=False, default=str)
+                        record = {"id": question_id(raw), "input": raw, "error": str(e)}
+                        if record["id"] in done:
+                            stats["skipped"] += 1
+                            continue
+                        done.add(record["id"])
+                        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        output.flush()
+                        stats["processed"] += 1
+                        stats["failed"] += 1
+                        continue
+                    if item["id"] in done:
+                        stats["skipped"] += 1
+                        continue
+                    done.add(item["id"])
+
+                started = time.perf_counter()
+                result, error = None, None
+                try:
+                    result = await app.ainvoke(initial_state(item["question"]))
+                except Exception as e:
+                    error = repr(e)
+                record = to_record(item, result, time.perf_counter() - started, error)
+
+                async with lock:
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+                    stats["processed"] += 1
+                    stats["failed"] += int(error is not None)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return stats
+
+
+def run_batch(questions, output_path, concurrency=8, app=None):
+    return asyncio.run(arun_batch(questions, output_path, concurrency, app))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a question set through the RAG workflow")
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--embed-batch", type=int, default=64, help="max queries per coalesced embedding call")
+    args = parser.parse_args(argv)
+
+    # 동시에 진행 중인 질문들의 query 임베딩을 묶어서 호출
+    resources.provide("embeddings", lambda r: BatchingEmbeddings(web_retriever.build_embeddings(), max_batch=args.embed_batch))
+    started = time.time()
+    stats = run_batch(read_questions(args.input), args.output, args.concurrency)
+    stats["elapsed"] = round(time.time() - started, 1)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Offline benchmark of the LangGraph workflow
+
+Runs the workflow from user_langgraph.py with resources overridden by deterministic
+fakes (chat model, embeddings, Tavily and a fixture HTML corpus), replays a question set at a given
+concurrency and reports latency percentiles, throughput and LLM calls per question.
+
+    python benchmark.py --concurrency 8 --llm-latency lognormal:0.8:0.5
+    python benchmark.py --output result.json
+    python benchmark.py --baseline result.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+from fakes import FIXTURE_DIRECTORY, CallCounter, FakeChatModel, FakeEmbeddings, FakeTavily, FixtureSession, LatencyModel
+
+QUESTIONS_PATH = os.path.join(FIXTURE_DIRECTORY, "questions.txt")
+
+
+def configure_workdir(workdir):
+    # 캐시, 인덱스, trace는 매 실행마다 임시 디렉터리에 만든다 (모듈 import 전에 설정)
+    os.environ["WEB_RETRIEVER_PERSIST_DIR"] = os.path.join(workdir, "chroma_db")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm_cache.sqlite")
+    os.environ["RAG_TRACE_PATH"] = os.path.join(workdir, "traces.jsonl")
+    os.environ["GRADER_LOG_PATH"] = os.path.join(workdir, "grader_decisions.jsonl")
+    os.environ["RAG_CHECKPOINT_PATH"] = os.path.join(workdir, "checkpoints.sqlite")
+    os.environ["SEARCH_CACHE_PATH"] = os.path.join(workdir, "search_cache.sqlite")
+    # fake 실행을 LangSmith로 올리면 네트워크 지연이 측정에 섞인다
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+
+def fake_resources(args, counter):
+    """
+    Fakes for every external dependency, to be passed to resources.override()
+
+    Returns:
+        dict: resource name -> fake instance
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+
+    return {
+        "llm": FakeChatModel(
+            latency=LatencyModel.parse(args.llm_latency, args.seed),
+            counter=counter,
+            relevant_ratio=args.relevant_ratio,
+            grounded_ratio=args.grounded_ratio,
+            useful_ratio=args.useful_ratio,
+        ),
+        "embeddings": FakeEmbeddings(latency=LatencyModel.parse(args.embedding_latency, args.seed + 1), counter=counter),
+        "tavily": FakeTavily(latency=LatencyModel.parse(args.tavily_latency, args.seed + 2), counter=counter),
+        "session": FixtureSession(),
+        "rag_prompt": ChatPromptTemplate.from_messages([("human", "{question}\n\n{context}")]),
+    }
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    # nearest-rank
+    index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def replay(app, questions, concurrency):
+    from instrumentation import metrics
+    from user_langgraph import initial_state
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def one(question):
+        async with semaphore:
+            tracer = metrics.tracer(question=question)
+            error = None
+            started = time.perf_counter()
+            try:
+                await app.ainvoke(initial_state(question), config={"callbacks": [tracer]})
+            except Exception as e:
+                error = repr(e)
+            elapsed = time.perf_counter() - started
+            summary = tracer.finish()
+            results.append({
+                "question": question,
+                "latency": elapsed,
+                "llm_calls": sum(n["llm_calls"] for n in summary["nodes"].values()),
+                "error": error,
+            })
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(q) for q in questions))
+    return results, time.perf_counter() - started
+
+
+def report(results, wall_time, counter, args):
+    latencies = [r["latency"] for r in results]
+    questions = len(results) or 1
+    return {
+        "questions": len(results),
+        "concurrency": args.concurrency,
+        "errors": sum(1 for r in results if r["error"]),
+        "wall_time": wall_time,
+        "throughput": len(results) / wall_time if wall_time else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "llm_calls_per_question": sum(r["llm_calls"] for r in results) / questions,
+        "fake_llm_calls_per_question": counter.get("llm") / questions,
+        "embedding_calls_per_question": counter.get("embedding") / questions,
+        "tavily_calls_per_question": counter.get("tavily") / questions,
+    }
+
+
+def compare(result, baseline, tolerance):
+    # 지연 시간과 LLM 호출 수가 baseline보다 tolerance 이상 나빠지면 회귀
+    regressions = []
+    for key in ("latency_p50", "latency_p95", "llm_calls_per_question"):
+        if baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {baseline[key]:.4f} -> {result[key]:.4f}")
+    if baseline.get("throughput") and result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput: {baseline['throughput']:.4f} -> {result['throughput']:.4f}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the RAG workflow")
+    parser.add_argument("--questions", default=QUESTIONS_PATH, help="file with one question per line")
+    parser.add_argument("--rounds", type=int, default=1, help="replay the question set this many times")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency", default="lognormal:0.05:0.5", help="kind:mean[:spread] in seconds")
+    parser.add_argument("--embedding-latency", default="constant:0.01")
+    parser.add_argument("--tavily-latency", default="lognormal:0.2:0.5")
+    parser.add_argument("--relevant-ratio", type=float, default=0.8)
+    parser.add_argument("--grounded-ratio", type=float, default=0.9)
+    parser.add_argument("--useful-ratio", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true", help="keep the graph's own print output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.questions, encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()] * args.rounds
+
+    counter = CallCounter()
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_workdir(workdir)
+        from resources import resources
+        from resilience import dependencies
+        from user_langgraph import workflow
+
+        # fake에는 upstream rate limit이 없으므로 token bucket 대기는 측정에서 뺀다
+        for dependency in dependencies.values():
+            dependency.rate = None
+
+        with resources.override(**fake_resources(args, counter)):
+            app = workflow.compile()
+            resources.get("retriever")
+            # 인덱스가 비어 있으면 모든 질문이 웹 검색으로 빠져 다른 경로를 측정하게 된다
+            if not resources.get("vectorstore").get(limit=1)["ids"]:
+                raise SystemExit("benchmark index is empty: no chunks were extracted from the fixture pages")
+            # 인덱싱 중 호출은 제외하고 질문 처리만 센다
+            counter.counts.clear()
+
+            output = sys.stdout if args.verbose else io.StringIO()
+            with contextlib.redirect_stdout(output):
+                results, wall_time = asyncio.run(replay(app, questions, args.concurrency))
+
+    result = report(results, wall_time, counter, args)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
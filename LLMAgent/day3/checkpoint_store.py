@@ -0,0 +1,253 @@
+"""
+Durable conversation state for the chat front ends
+
+The chat workflow is compiled with a SQLite checkpointer so every completed node is
+saved under the conversation's thread_id: a run interrupted by a crash or restart is
+resumed from the last completed node instead of retrieving and grading again. The
+chat history shown to the user is kept in the same file. Old checkpoints and
+inactive threads are pruned on startup and after each run to bound disk use.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+CHECKPOINT_PATH = os.environ.get(
+    "RAG_CHECKPOINT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints.sqlite"),
+)
+# 재개에는 마지막 checkpoint만 필요하므로 스레드마다 최근 몇 개만 남긴다
+KEEP_CHECKPOINTS_PER_THREAD = 10
+MAX_MESSAGES_PER_THREAD = 200
+THREAD_TTL_DAYS = 30
+
+
+class ThreadedSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver whose async methods run the sync ones in a worker thread
+
+    SqliteSaver only implements the sync interface; this lets the same checkpointer
+    serve both stream() in Streamlit and astream() in the CLI.
+    """
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, *args, **kwargs):
+        return await asyncio.to_thread(self.put_writes, *args, **kwargs)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def build_checkpointer(path=CHECKPOINT_PATH):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    checkpointer = ThreadedSqliteSaver(conn)
+    checkpointer.setup()
+    return checkpointer
+
+
+def thread_config(thread_id, callbacks=None):
+    config = {"configurable": {"thread_id": thread_id}}
+    if callbacks:
+        config["callbacks"] = callbacks
+    return config
+
+
+def pending_question(app, thread_id):
+    """
+    Question of the run left unfinished on thread_id, if any
+
+    Returns:
+        str: the question to resume with app.stream(None, ...), None when the last run finished
+    """
+    snapshot = app.get_state(thread_config(thread_id))
+    if not snapshot.next:
+        return None
+    return snapshot.values.get("question")
+
+
+def message_sources(documents):
+    # front end가 참조 문서로 보여주는 metadata만 남긴다
+    sources = []
+    for doc in documents or []:
+        metadata = getattr(doc, "metadata", {})
+        sources.append({
+            "title": metadata.get("title", "제목 없음"),
+            "url": metadata.get("url", "#"),
+            "source": metadata.get("source", "vectorstore"),
+            "score": metadata.get("score", "N/A"),
+        })
+    return sources
+
+
+class ConversationStore(object):
+    """
+    Chat history per thread_id, stored next to the graph checkpoints
+
+    Messages are {"role", "content", "sources"} dicts as rendered by the front ends.
+    prune() also trims the checkpointer tables, since both live in the same file.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH, max_messages=MAX_MESSAGES_PER_THREAD,
+                 keep_checkpoints=KEEP_CHECKPOINTS_PER_THREAD, ttl_days=THREAD_TTL_DAYS):
+        self.path = path
+        self.max_messages = max_messages
+        self.keep_checkpoints = keep_checkpoints
+        self.ttl_days = ttl_days
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, thread_id TEXT NOT NULL, role TEXT NOT NULL, "
+                "content TEXT NOT NULL, sources TEXT, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_thread ON messages(thread_id, id)")
+
+    def _connect(self):
+        # 연결을 스레드 간에 공유하지 않도록 호출마다 새로 연다
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, thread_id, role, content, sources=None):
+        now = time.time()
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO messages (thread_id, role, content, sources, created_at) VALUES (?, ?, ?, ?, ?)",
+                (thread_id, role, content, json.dumps(sources, ensure_ascii=False) if sources is not None else None, now),
+            )
+            conn.execute("INSERT OR REPLACE INTO threads (thread_id, updated_at) VALUES (?, ?)", (thread_id, now))
+
+    def messages(self, thread_id):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content, sources FROM messages WHERE thread_id = ? ORDER BY id", (thread_id,)
+            ).fetchall()
+        messages = []
+        for role, content, sources in rows:
+            message = {"role": role, "content": content}
+            if sources is not None:
+                message["sources"] = json.loads(sources)
+            messages.append(message)
+        return messages
+
+    def clear(self, thread_id):
+        # 대화 기록과 함께 그래프 checkpoint도 지운다
+        with self.lock, self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+            conn.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+            if _has_checkpoint_tables(conn):
+                conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    def discard_run(self, thread_id):
+        """
+        Drop the graph checkpoints of one thread but keep its messages, so a failed run is not resumed again
+        """
+        with self.lock, self._connect() as conn:
+            if _has_checkpoint_tables(conn):
+                conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    def trim(self, thread_id):
+        """
+        Keep only the latest checkpoints and messages of one thread; cheap enough to run after every answer
+        """
+        with self.lock, self._connect() as conn:
+            return _trim_thread(conn, thread_id, self.keep_checkpoints, self.max_messages)
+
+    def prune(self, vacuum=True):
+        """
+        Drop threads inactive for ttl_days and trim every other thread
+
+        Args:
+            vacuum (bool): Compact the file afterwards so deleted rows give disk space back
+
+        Returns:
+            dict: numbers of expired threads and deleted checkpoints and messages
+        """
+        cutoff = time.time() - self.ttl_days * 24 * 60 * 60
+        stats = {"expired_threads": 0, "checkpoints": 0, "messages": 0}
+        with self.lock, self._connect() as conn:
+            expired = [row[0] for row in conn.execute("SELECT thread_id FROM threads WHERE updated_at < ?", (cutoff,))]
+            checkpoints = _has_checkpoint_tables(conn)
+            for thread_id in expired:
+                stats["messages"] += conn.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,)).rowcount
+                conn.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+                if checkpoints:
+                    stats["checkpoints"] += conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,)).rowcount
+                    conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+            stats["expired_threads"] = len(expired)
+
+            thread_ids = {row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM messages")}
+            if checkpoints:
+                thread_ids |= {row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints")}
+            for thread_id in thread_ids:
+                deleted = _trim_thread(conn, thread_id, self.keep_checkpoints, self.max_messages)
+                stats["checkpoints"] += deleted["checkpoints"]
+                stats["messages"] += deleted["messages"]
+
+        if vacuum and (stats["checkpoints"] or stats["messages"]):
+            # VACUUM은 트랜잭션 밖에서 실행해야 한다
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            try:
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+        return stats
+
+
+def _has_checkpoint_tables(conn):
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('checkpoints', 'writes')")
+    return len(rows.fetchall()) == 2
+
+
+def _trim_thread(conn, thread_id, keep_checkpoints, max_messages):
+    deleted = {"checkpoints": 0, "messages": 0}
+    if _has_checkpoint_tables(conn):
+        # checkpoint_id는 시간순으로 정렬되는 uuid6이다
+        for (checkpoint_ns,) in conn.execute(
+            "SELECT DISTINCT checkpoint_ns FROM checkpoints WHERE thread_id = ?", (thread_id,)
+        ).fetchall():
+            deleted["checkpoints"] += conn.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ("
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT ?)",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns, keep_checkpoints),
+            ).rowcount
+        conn.execute(
+            "DELETE FROM writes WHERE thread_id = ? AND NOT EXISTS ("
+            "SELECT 1 FROM checkpoints c WHERE c.thread_id = writes.thread_id "
+            "AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id)",
+            (thread_id,),
+        )
+    deleted["messages"] = conn.execute(
+        "DELETE FROM messages WHERE thread_id = ? AND id NOT IN ("
+        "SELECT id FROM messages WHERE thread_id = ? ORDER BY id DESC LIMIT ?)",
+        (thread_id, thread_id, max_messages),
+    ).rowcount
+    return deleted
+
+
+def build_conversation_store(path=CHECKPOINT_PATH):
+    store = ConversationStore(path)
+    stats = store.prune()
+    if stats["expired_threads"] or stats["checkpoints"] or stats["messages"]:
+        print(f"---PRUNED CHECKPOINTS: {stats}---")
+    return store
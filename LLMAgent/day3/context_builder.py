@@ -0,0 +1,150 @@
+"""
+Compact prompt context for the generate and hallucination_check nodes
+
+Removes the overlap the splitter leaves between neighbouring chunks of the same
+page, drops duplicates, orders chunks by retrieval score and packs them into a
+token budget as numbered plain-text sections instead of Document reprs. Web search
+results and retrieved chunks are scored on different scales, so each source is
+ranked on its own and the two rankings are interleaved.
+"""
+try:
+    import tiktoken
+except ImportError:  # tiktoken이 없으면 글자 수로 토큰 수를 추정
+    tiktoken = None
+
+CONTEXT_TOKEN_BUDGET = 3000
+# splitter의 chunk_overlap(200)보다 넉넉하게 겹침을 찾는다
+MAX_OVERLAP = 400
+MIN_OVERLAP = 20
+# 남은 예산이 이보다 작으면 마지막 문서를 잘라 넣지 않는다
+MIN_TRUNCATED_TOKENS = 100
+ENCODING_NAME = "o200k_base"
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+        except Exception:
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+def _overlap(previous, current):
+    # previous의 끝과 current의 시작이 겹치는 가장 긴 길이
+    for size in range(min(MAX_OVERLAP, len(previous), len(current)), MIN_OVERLAP - 1, -1):
+        if previous.endswith(current[:size]):
+            return size
+    return 0
+
+
+def _relevance(doc):
+    score = doc.metadata.get("score")
+    if isinstance(score, (int, float)):
+        return score
+    rrf_score = doc.metadata.get("rrf_score")
+    return rrf_score if isinstance(rrf_score, (int, float)) else 0.0
+
+
+def _source(doc):
+    return "web" if doc.metadata.get("source") == "web" else "retrieved"
+
+
+def rank_by_source(sections):
+    """
+    Order (Document, text) pairs by relative rank within their source
+
+    Tavily scores and vector/RRF scores are not comparable, so a section's position is
+    its rank among sections of the same source divided by that source's size; ties
+    keep the original order.
+    """
+    groups = {}
+    for i, (doc, _) in enumerate(sections):
+        groups.setdefault(_source(doc), []).append(i)
+    position = {}
+    for indices in groups.values():
+        indices.sort(key=lambda i: -_relevance(sections[i][0]))
+        for rank, i in enumerate(indices):
+            position[i] = rank / len(indices)
+    return [sections[i] for i in sorted(range(len(sections)), key=lambda i: (position[i], i))]
+
+
+def dedup_documents(documents):
+    """
+    Drop exact duplicates and trim text shared with other chunks of the same page
+
+    Returns:
+        list: (Document, text) pairs in the original order
+    """
+    seen = set()
+    kept = {}
+    results = []
+    for doc in documents:
+        original = doc.page_content.strip()
+        if not original or original in seen:
+            continue
+        seen.add(original)
+        url = doc.metadata.get("url")
+        text = original
+        # 검색 결과는 페이지 순서가 아니므로 같은 페이지의 모든 chunk와 양방향으로 비교
+        for other in kept.get(url, []):
+            size = _overlap(other, text)
+            if size:
+                text = text[size:]
+            size = _overlap(text, other)
+            if size:
+                text = text[:-size]
+        if url is not None:
+            kept.setdefault(url, []).append(original)
+        text = text.strip()
+        if text:
+            results.append((doc, text))
+    return results
+
+
+def build_context(documents, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Serialize documents into a compact context string within token_budget
+
+    Args:
+        documents (list): Retrieved and graded documents
+        token_budget (int): Maximum number of tokens of the returned context
+
+    Returns:
+        str: numbered "[n] title (url)" sections, most relevant first within each source
+    """
+    # 원래 순서로 겹침을 제거한 뒤 출처별 관련도 순위로 정렬
+    sections = rank_by_source(dedup_documents(documents))
+
+    parts = []
+    remaining = token_budget
+    for doc, text in sections:
+        title = doc.metadata.get("title") or "untitled"
+        url = doc.metadata.get("url")
+        header = f"[{len(parts) + 1}] {title}" + (f" ({url})" if url else "")
+        cost = count_tokens(header) + count_tokens(text) + 2
+        if cost > remaining:
+            available = remaining - count_tokens(header) - 2
+            if available >= MIN_TRUNCATED_TOKENS:
+                parts.append(f"{header}\n{truncate_tokens(text, available)}")
+            break
+        parts.append(f"{header}\n{text}")
+        remaining -= cost
+    return "\n\n".join(parts)
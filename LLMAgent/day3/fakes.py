@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import math
+import os
+import random
+import re
+import threading
+import time
+
+import requests
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FIXTURE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_fixtures")
+
+
+def fraction(*parts):
+    # 입력이 같으면 항상 같은 [0, 1) 값
+    digest = hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) / 0x100000000
+
+
+class LatencyModel(object):
+    """
+    Latency distribution in seconds: constant, uniform, normal or lognormal
+    """
+
+    def __init__(self, kind="constant", mean=0.0, spread=0.0, seed=0):
+        self.kind = kind
+        self.mean = mean
+        self.spread = spread
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec, seed=0):
+        # "lognormal:0.8:0.5" -> kind, mean, spread
+        kind, *values = spec.split(":")
+        values = [float(v) for v in values] + [0.0, 0.0]
+        return cls(kind, values[0], values[1], seed)
+
+    def sample(self):
+        with self.lock:
+            if self.kind == "constant":
+                return self.mean
+            if self.kind == "uniform":
+                return self.random.uniform(max(0.0, self.mean - self.spread), self.mean + self.spread)
+            if self.kind == "normal":
+                return max(0.0, self.random.gauss(self.mean, self.spread))
+            if self.kind == "lognormal":
+                if self.mean <= 0:
+                    return 0.0
+                # mean을 유지하는 lognormal
+                mu = math.log(self.mean) - self.spread ** 2 / 2
+                return self.random.lognormvariate(mu, self.spread)
+            raise ValueError(f"unknown latency distribution: {self.kind}")
+
+
+class CallCounter(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def get(self, name):
+        return self.counts.get(name, 0)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model answering the prompts in llm_chain.py
+
+    Graders answer yes/no from a hash of their input so the same question always takes
+    the same path through the graph; relevant_ratio and grounded_ratio set how often.
+    """
+
+    model_name: str = "fake-chat"
+    temperature: float = 0
+    latency: LatencyModel = None
+    counter: CallCounter = None
+    relevant_ratio: float = 0.8
+    grounded_ratio: float = 0.9
+    useful_ratio: float = 0.95
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _respond(self, messages):
+        system = messages[0].content if messages else ""
+        prompt = "\n".join(str(m.content) for m in messages)
+        if "relevance" in system:
+            kind, content = "retrieval_grade", '{"score": "%s"}' % ("yes" if fraction(prompt) < self.relevant_ratio else "no")
+        elif "two criteria" in system:
+            grounded = "yes" if fraction(prompt) < self.grounded_ratio else "no"
+            useful = "yes" if fraction(prompt, "useful") < self.useful_ratio else "no"
+            kind, content = "answer_quality_grade", '{"grounded": "%s", "useful": "%s"}' % (grounded, useful)
+        elif "hallucinated" in system:
+            kind, content = "hallucination_grade", '{"score": "%s"}' % ("no" if fraction(prompt) < self.grounded_ratio else "yes")
+        elif "useful" in system:
+            kind, content = "answer_grade", '{"score": "yes"}'
+        else:
+            kind, content = "generate", f"This is a fake answer built from {len(prompt)} characters of context."
+        if self.counter is not None:
+            self.counter.add("llm")
+            self.counter.add(f"llm.{kind}")
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content, usage_metadata=usage))],
+                          llm_output={"model_name": self.model_name})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency.sample())
+        return self._respond(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency.sample())
+        return self._respond(messages)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hashed bag-of-words embeddings, so questions sharing words end up close together
+    """
+
+    def __init__(self, size=256, latency=None, counter=None):
+        self.size = size
+        self.latency = latency
+        self.counter = counter
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.size] += 1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts):
+        if self.counter is not None:
+            self.counter.add("embedding")
+            self.counter.add("embedding.texts", len(texts))
+        if self.latency:
+            time.sleep(self.latency.sample())
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        if self.counter is not None:
+            self.counter.add("embedding")
+            self.counter.add("embedding.texts", len(texts))
+        if self.latency:
+            await asyncio.sleep(self.latency.sample())
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeTavily(object):
+    """
+    Stand-in for search_client.AsyncTavily returning canned results
+    """
+
+    def __init__(self, latency=None, counter=None, results=3):
+        self.latency = latency
+        self.counter = counter
+        self.results = results
+
+    def _results(self, query):
+        if self.counter is not None:
+            self.counter.add("tavily")
+        return {"query": query, "results": [
+            {
+                "url": f"https://example.com/search/{i}",
+                "title": f"Result {i} for {query}",
+                "content": f"Web search result {i} about {query}.",
+                "score": round(1.0 - i * 0.1, 2),
+            }
+            for i in range(self.results)
+        ]}
+
+    def search(self, query, **kwargs):
+        if self.latency:
+            time.sleep(self.latency.sample())
+        return self._results(query)
+
+    async def asearch(self, query, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency.sample())
+        return self._results(query)
+
+
+class FixtureSession(requests.Session):
+    """
+    requests.Session serving pages from benchmark_fixtures/ by the last URL path segment
+    """
+
+    fixture_directory = FIXTURE_DIRECTORY
+
+    def get(self, url, **kwargs):
+        slug = url.rstrip("/").rsplit("/", 1)[-1]
+        path = os.path.join(self.fixture_directory, slug + ".html")
+        response = requests.models.Response()
+        response.url = url
+        response.encoding = "utf-8"
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                response._content = f.read()
+            response.status_code = 200
+        else:
+            response._content = b""
+            response.status_code = 404
+        return response
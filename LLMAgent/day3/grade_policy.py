@@ -0,0 +1,144 @@
+"""
+Similarity-score pre-filter for document grading
+
+Chunks whose retrieval score is at or above the accept threshold are graded relevant
+and chunks at or below the reject threshold irrelevant without asking the LLM; only
+the band in between goes to retrieval_grade_chain. Every LLM decision on a scored
+chunk is logged so the thresholds can be fitted from real grades:
+
+    python grade_policy.py --target 0.97 --min-support 20
+"""
+import argparse
+import json
+import os
+import threading
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+THRESHOLDS_PATH = os.environ.get("GRADE_THRESHOLDS_PATH", os.path.join(DIRECTORY, "grade_thresholds.json"))
+DECISION_LOG_PATH = os.environ.get("GRADER_LOG_PATH", os.path.join(DIRECTORY, "grader_decisions.jsonl"))
+
+# 검색 점수를 내는 Chroma 컬렉션의 거리 공간; 다른 공간에서 기록하거나 보정한 값은 척도가 달라 쓰지 않는다
+SCORE_SPACE = "cosine"
+
+_log_lock = threading.Lock()
+
+
+def load_thresholds(path=THRESHOLDS_PATH):
+    """
+    Returns:
+        dict: {"accept": float|None, "reject": float|None}; both None when not calibrated
+        for SCORE_SPACE
+    """
+    if not os.path.exists(path):
+        return {"accept": None, "reject": None}
+    with open(path, encoding="utf-8") as f:
+        stored = json.load(f)
+    if stored.get("space") != SCORE_SPACE:
+        return {"accept": None, "reject": None}
+    return {"accept": stored.get("accept"), "reject": stored.get("reject")}
+
+
+def prefilter(documents, thresholds):
+    """
+    Decide grades from metadata['score'] where the thresholds make the answer clear
+
+    Returns:
+        list: "yes", "no" or None (ask the LLM) per document
+    """
+    accept, reject = thresholds.get("accept"), thresholds.get("reject")
+    grades = []
+    for doc in documents:
+        score = doc.metadata.get("score")
+        # 웹 검색 결과의 score는 Tavily 점수라 보정한 threshold와 척도가 다르다
+        if doc.metadata.get("source") == "web" or not isinstance(score, (int, float)):
+            grades.append(None)
+        elif accept is not None and score >= accept:
+            grades.append("yes")
+        elif reject is not None and score <= reject:
+            grades.append("no")
+        else:
+            grades.append(None)
+    return grades
+
+
+def log_decisions(question, documents, grades, path=DECISION_LOG_PATH):
+    # 점수가 있는 문서에 대한 LLM 판정만 보정 데이터로 남긴다
+    lines = []
+    for doc, grade in zip(documents, grades):
+        score = doc.metadata.get("score")
+        if grade in ("yes", "no") and isinstance(score, (int, float)) and doc.metadata.get("source") != "web":
+            lines.append(json.dumps({"question": question, "url": doc.metadata.get("url"),
+                                     "score": score, "grade": grade, "space": SCORE_SPACE}, ensure_ascii=False))
+    if not lines or not path:
+        return
+    with _log_lock, open(path, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def calibrate(decisions, target=0.97, min_support=20):
+    """
+    Fit thresholds so the auto decisions agree with the LLM at least target of the time
+
+    Args:
+        decisions (list): dicts with "score" and "grade"
+        target (float): Required agreement for auto-accept and auto-reject
+        min_support (int): Size of the score window whose agreement is checked
+
+    Returns:
+        dict: accept/reject thresholds (None when no threshold meets the target) and stats
+    """
+    decisions = sorted(decisions, key=lambda d: d["score"])
+    scores = [d["score"] for d in decisions]
+    relevant = [d["grade"] == "yes" for d in decisions]
+    n = len(decisions)
+    window = max(1, min_support)
+
+    # accept: 위에서부터 min_support개씩 묶은 구간마다 relevant 비율이 target 이상인 동안 내려간다
+    # (전체 평균이 아니라 경계 근처 구간의 정확도로 판단)
+    accept = None
+    for i in range(n - window, -1, -1):
+        if sum(relevant[i:i + window]) / window < target:
+            break
+        if i == 0 or scores[i - 1] != scores[i]:
+            accept = scores[i]
+
+    # reject: 아래에서부터 같은 방식으로 irrelevant 비율을 본다
+    reject = None
+    for i in range(window - 1, n):
+        if sum(not r for r in relevant[i - window + 1:i + 1]) / window < target:
+            break
+        if i == n - 1 or scores[i + 1] != scores[i]:
+            reject = scores[i]
+
+    if accept is not None and reject is not None and reject >= accept:
+        accept = reject = None
+
+    auto = sum(1 for s in scores if (accept is not None and s >= accept) or (reject is not None and s <= reject))
+    return {
+        "accept": accept,
+        "reject": reject,
+        "target": target,
+        "samples": n,
+        "auto_decided_ratio": auto / n if n else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit grade_documents score thresholds from logged LLM grades")
+    parser.add_argument("--log", default=DECISION_LOG_PATH)
+    parser.add_argument("--output", default=THRESHOLDS_PATH)
+    parser.add_argument("--target", type=float, default=0.97)
+    parser.add_argument("--min-support", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with open(args.log, encoding="utf-8") as f:
+        decisions = [json.loads(line) for line in f if line.strip()]
+    decisions = [d for d in decisions if d.get("space") == SCORE_SPACE]
+    result = dict(calibrate(decisions, args.target, args.min_support), space=SCORE_SPACE)
+    print(json.dumps(result, indent=2))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
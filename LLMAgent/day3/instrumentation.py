@@ -0,0 +1,285 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from resilience import RETRY_EVENT, dependencies
+
+TRACE_PATH = os.environ.get(
+    "RAG_TRACE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl"),
+)
+
+CHAINS = ("rag", "retrieval_grade", "answer_generation", "hallucination_grader", "answer_grade", "answer_quality")
+
+# USD per 1M tokens (input, output)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def llm_cost(model, prompt_tokens, completion_tokens):
+    for name, (input_price, output_price) in sorted(MODEL_PRICES.items(), key=lambda x: -len(x[0])):
+        if model and model.startswith(name):
+            return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+    return 0.0
+
+
+def _usage(response):
+    # 메시지의 usage_metadata가 없으면 llm_output의 token_usage를 사용
+    prompt_tokens = completion_tokens = 0
+    found = False
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+                found = True
+    if not found and response.llm_output:
+        usage = response.llm_output.get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+    model = (response.llm_output or {}).get("model_name")
+    return model, prompt_tokens, completion_tokens
+
+
+class RequestTracer(BaseCallbackHandler):
+    """
+    Callback handler collecting per-node and per-chain metrics for one graph run
+
+    Pass it as config={"callbacks": [tracer]} to invoke/stream/ainvoke/astream and call
+    finish() when the run is over.
+    """
+
+    def __init__(self, registry, request_id=None, question=None):
+        self.registry = registry
+        self.request_id = request_id or uuid.uuid4().hex
+        self.question = question
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.runs = {}
+        # 열린 run마다 그 run을 포함하는 노드 run의 id
+        self.owners = {}
+        self.llm_runs = {}
+        self.nodes = defaultdict(lambda: {
+            "runs": 0, "duration": 0.0, "llm_calls": 0, "prompt_tokens": 0,
+            "completion_tokens": 0, "cost": 0.0, "retries": 0, "errors": 0,
+        })
+        self.chains = defaultdict(lambda: {"runs": 0, "duration": 0.0, "errors": 0})
+        self.durations = []
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, name=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        with self.lock:
+            # 노드 안의 RunnableLambda도 노드 이름으로 시작하므로 이미 열린 노드 run 아래의 run은 세지 않는다
+            owner = self.owners.get(parent_run_id)
+            inside_node = self.runs.get(owner, ())[:2] == ("node", node)
+            if node and name == node and not inside_node:
+                self.runs[run_id] = ("node", node, time.perf_counter())
+                self.owners[run_id] = run_id
+                return
+            if owner is not None:
+                self.owners[run_id] = owner
+            if name in CHAINS:
+                self.runs[run_id] = ("chain", name, time.perf_counter())
+
+    def _end_run(self, run_id, error=False):
+        with self.lock:
+            self.owners.pop(run_id, None)
+            run = self.runs.pop(run_id, None)
+            if run is None:
+                return
+            kind, name, started = run
+            elapsed = time.perf_counter() - started
+            stats = self.nodes[name] if kind == "node" else self.chains[name]
+            stats["runs"] += 1
+            stats["duration"] += elapsed
+            stats["errors"] += int(error)
+            if kind == "node":
+                self.durations.append((name, elapsed))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_run(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_run(run_id, error=True)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        with self.lock:
+            self.llm_runs[run_id] = (metadata or {}).get("langgraph_node", "unknown")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, metadata=metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        model, prompt_tokens, completion_tokens = _usage(response)
+        with self.lock:
+            node = self.llm_runs.pop(run_id, "unknown")
+            stats = self.nodes[node]
+            stats["llm_calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost"] += llm_cost(model, prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            node = self.llm_runs.pop(run_id, "unknown")
+            self.nodes[node]["llm_calls"] += 1
+            self.nodes[node]["errors"] += 1
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        with self.lock:
+            node = self.llm_runs.get(run_id, "unknown")
+            self.nodes[node]["retries"] += 1
+
+    def on_custom_event(self, name, data, *, run_id, metadata=None, **kwargs):
+        # 재시도는 resilience.Dependency가 보내며, 실행 중인 노드의 metadata로 노드를 찾는다
+        if name != RETRY_EVENT:
+            return
+        with self.lock:
+            self.nodes[(metadata or {}).get("langgraph_node", "unknown")]["retries"] += 1
+
+    def summary(self):
+        with self.lock:
+            nodes = {}
+            for name, stats in self.nodes.items():
+                # 같은 노드가 다시 실행된 횟수(재생성, 재평가)
+                nodes[name] = dict(stats, reruns=max(0, stats["runs"] - 1))
+            return {
+                "request_id": self.request_id,
+                "question": self.question,
+                "started_at": self.started_at,
+                "duration": time.time() - self.started_at,
+                "nodes": nodes,
+                "chains": {name: dict(stats) for name, stats in self.chains.items()},
+            }
+
+    def finish(self):
+        """
+        Merge this run into the registry and append it to the JSONL trace
+
+        Returns:
+            dict: summary of the run
+        """
+        summary = self.summary()
+        self.registry.record(summary, list(self.durations))
+        return summary
+
+
+class MetricsRegistry(object):
+    """
+    Process-wide aggregation of RequestTracer summaries
+
+    Exposes Prometheus text format through render_prometheus() and appends one JSON
+    line per request to trace_path.
+    """
+
+    def __init__(self, trace_path=TRACE_PATH):
+        self.trace_path = trace_path
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.request_duration = 0.0
+        self.nodes = defaultdict(lambda: defaultdict(float))
+        self.chains = defaultdict(lambda: defaultdict(float))
+        self.buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+
+    def tracer(self, request_id=None, question=None):
+        return RequestTracer(self, request_id, question)
+
+    def record(self, summary, durations):
+        with self.lock:
+            self.requests += 1
+            self.request_duration += summary["duration"]
+            for name, stats in summary["nodes"].items():
+                for key, value in stats.items():
+                    self.nodes[name][key] += value
+            for name, stats in summary["chains"].items():
+                for key, value in stats.items():
+                    self.chains[name][key] += value
+            for name, elapsed in durations:
+                for i, bound in enumerate(DURATION_BUCKETS):
+                    if elapsed <= bound:
+                        self.buckets[name][i] += 1
+            if self.trace_path:
+                with open(self.trace_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+
+    def render_prometheus(self, include_dependencies=True):
+        with self.lock:
+            lines = [
+                "# TYPE rag_requests_total counter",
+                f"rag_requests_total {self.requests}",
+                "# TYPE rag_request_duration_seconds_sum counter",
+                f"rag_request_duration_seconds_sum {self.request_duration:.6f}",
+            ]
+            node_metrics = (
+                ("rag_node_runs_total", "runs"),
+                ("rag_node_reruns_total", "reruns"),
+                ("rag_node_retries_total", "retries"),
+                ("rag_node_errors_total", "errors"),
+                ("rag_llm_calls_total", "llm_calls"),
+                ("rag_llm_prompt_tokens_total", "prompt_tokens"),
+                ("rag_llm_completion_tokens_total", "completion_tokens"),
+                ("rag_llm_cost_usd_total", "cost"),
+            )
+            for metric, key in node_metrics:
+                lines.append(f"# TYPE {metric} counter")
+                for name, stats in sorted(self.nodes.items()):
+                    lines.append(f'{metric}{{node="{name}"}} {stats[key]:g}')
+
+            lines.append("# TYPE rag_node_duration_seconds histogram")
+            for name, stats in sorted(self.nodes.items()):
+                if not stats["runs"]:
+                    continue
+                for bound, count in zip(DURATION_BUCKETS, self.buckets[name]):
+                    lines.append(f'rag_node_duration_seconds_bucket{{node="{name}",le="{bound}"}} {count}')
+                lines.append(f'rag_node_duration_seconds_bucket{{node="{name}",le="+Inf"}} {stats["runs"]:g}')
+                lines.append(f'rag_node_duration_seconds_sum{{node="{name}"}} {stats["duration"]:.6f}')
+                lines.append(f'rag_node_duration_seconds_count{{node="{name}"}} {stats["runs"]:g}')
+
+            for metric, key in (("rag_chain_runs_total", "runs"), ("rag_chain_duration_seconds_sum", "duration")):
+                lines.append(f"# TYPE {metric} counter")
+                for name, stats in sorted(self.chains.items()):
+                    lines.append(f'{metric}{{chain="{name}"}} {stats[key]:g}')
+
+        if not include_dependencies:
+            return "\n".join(lines) + "\n"
+        # 외부 dependency별 재시도, 실패, circuit breaker 상태
+        dependency_stats = {name: dependency.stats() for name, dependency in sorted(dependencies.items())}
+        for metric, key in (("rag_dependency_calls_total", "calls"), ("rag_dependency_retries_total", "retries"),
+                            ("rag_dependency_failures_total", "failures"), ("rag_dependency_rejected_total", "rejected")):
+            lines.append(f"# TYPE {metric} counter")
+            for name, stats in dependency_stats.items():
+                lines.append(f'{metric}{{dependency="{name}"}} {stats[key]}')
+        lines.append("# TYPE rag_dependency_circuit_open gauge")
+        for name, stats in dependency_stats.items():
+            lines.append(f'rag_dependency_circuit_open{{dependency="{name}"}} {int(stats["state"] == "open")}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # node_exporter textfile collector 형식으로 저장
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+
+metrics = MetricsRegistry()
+
+
+def format_summary(summary):
+    lines = []
+    for name, stats in summary["nodes"].items():
+        lines.append(
+            f"{name:<20} {stats['duration']:>7.2f}s  runs={stats['runs']:<2} llm={stats['llm_calls']:<2} "
+            f"tokens={stats['prompt_tokens']}/{stats['completion_tokens']} ${stats['cost']:.5f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,138 @@
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import Counter, defaultdict
+
+from langchain_core.documents import Document
+
+try:
+    import fcntl
+except ImportError:  # Windows에는 fcntl이 없어 파일 잠금 없이 저장한다
+    fcntl = None
+
+KEYWORD_INDEX_FILE = "bm25.json"
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to what when where which who why with".split()
+)
+
+
+def tokenize(text):
+    return [t for t in re.findall(r"\w+", text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index(object):
+    """
+    In-process BM25 keyword index over the same chunks stored in Chroma
+
+    Chunks are added and removed by id as web_retrieve ingests sources, and the chunk
+    texts are saved next to the Chroma manifest so the index is reloaded, not rebuilt
+    from the web, on startup.
+    """
+
+    def __init__(self, path=None, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.RLock()
+        self.documents = {}
+        self.lengths = {}
+        self.postings = defaultdict(dict)
+        self.total_length = 0
+
+    @classmethod
+    def load(cls, persist_directory):
+        index = cls(os.path.join(persist_directory, KEYWORD_INDEX_FILE))
+        if os.path.exists(index.path):
+            with open(index.path, encoding="utf-8") as f:
+                stored = json.load(f)
+            for doc_id, doc in stored.items():
+                index._add(doc_id, Document(page_content=doc["page_content"], metadata=doc["metadata"]))
+        return index
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            stored = {
+                doc_id: {"page_content": doc.page_content, "metadata": doc.metadata}
+                for doc_id, doc in self.documents.items()
+            }
+        # 여러 프로세스(serve worker, Streamlit과 CLI)가 같은 파일에 저장하므로
+        # 프로세스마다 다른 임시 파일에 쓰고 잠금을 잡은 채로 교체한다
+        directory = os.path.dirname(self.path) or "."
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp",
+                                             delete=False) as f:
+                json.dump(stored, f, ensure_ascii=False)
+            try:
+                os.replace(f.name, self.path)
+            except OSError:
+                os.unlink(f.name)
+                raise
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _add(self, doc_id, doc):
+        if doc_id in self.documents:
+            self._remove(doc_id)
+        counts = Counter(tokenize(doc.page_content))
+        self.documents[doc_id] = doc
+        self.lengths[doc_id] = sum(counts.values())
+        self.total_length += self.lengths[doc_id]
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+
+    def _remove(self, doc_id):
+        doc = self.documents.pop(doc_id, None)
+        if doc is None:
+            return
+        self.total_length -= self.lengths.pop(doc_id)
+        for term in set(tokenize(doc.page_content)):
+            self.postings[term].pop(doc_id, None)
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def add(self, ids, documents):
+        with self.lock:
+            for doc_id, doc in zip(ids, documents):
+                self._add(doc_id, doc)
+
+    def remove(self, ids):
+        with self.lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+
+    def search(self, query, k=6):
+        """
+        Rank chunks by BM25 score
+
+        Args:
+            query (str): The search query
+            k (int): Number of results
+
+        Returns:
+            list: (doc_id, Document, score) tuples, best first
+        """
+        with self.lock:
+            n = len(self.documents)
+            if not n:
+                return []
+            avgdl = self.total_length / n
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / avgdl)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda x: -x[1])[:k]
+            return [(doc_id, self.documents[doc_id], score) for doc_id, score in ranked]
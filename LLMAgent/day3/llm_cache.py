@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.runnables import RunnableLambda
+
+CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.sqlite"),
+)
+
+
+class SQLiteResponseCache(object):
+    """
+    Persistent exact-match cache for deterministic chain outputs
+
+    Values are stored as JSON in a table of a local SQLite file. Every evict_every puts
+    the least recently used rows beyond max_entries are deleted, so the table can run
+    up to evict_every - 1 rows over max_entries in between. Hits and misses are
+    counted by get().
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=100000, table="responses", evict_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.table = table
+        self.evict_every = evict_every
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table}(last_access)")
+
+    def _connect(self):
+        # 연결을 스레드 간에 공유하지 않도록 호출마다 새로 연다
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _read(self, key, touch=True):
+        """
+        Returns:
+            tuple: (value, created_at) or None when the key is not stored
+        """
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if touch:
+                conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def get(self, key):
+        entry = self._read(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.puts += 1
+            evict = self.puts % self.evict_every == 0
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            if evict:
+                self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        # 매번 COUNT하지 않고 last_access index로 max_entries 이후의 행만 지운다
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN "
+            f"(SELECT key FROM {self.table} ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def size(self):
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": self.size(),
+        }
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.pretty_repr().encode("utf-8")).hexdigest()
+
+
+def cached_chain(chain, prompt, llm, cache, is_valid=lambda output: isinstance(output, dict) and "score" in output):
+    """
+    Wrap a deterministic chain so identical inputs are answered from the cache
+
+    Args:
+        chain (Runnable): prompt | llm | parser chain to wrap
+        prompt (ChatPromptTemplate): The chain's prompt, hashed into the key
+        llm (ChatOpenAI): The chain's model, its name and temperature go into the key
+        cache (SQLiteResponseCache): Where responses are stored
+        is_valid (callable): Only outputs passing this check are cached
+
+    Returns:
+        Runnable: chain with the same invoke/ainvoke/batch/abatch interface
+    """
+    namespace = {
+        "model": llm.model_name,
+        "temperature": llm.temperature,
+        "prompt": prompt_hash(prompt),
+    }
+
+    def make_key(inputs):
+        payload = dict(namespace, inputs=inputs)
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+    def invoke(inputs, config=None):
+        key = make_key(inputs)
+        output = cache.get(key)
+        if output is not None:
+            return output
+        output = chain.invoke(inputs, config=config)
+        if is_valid(output):
+            cache.put(key, output)
+        return output
+
+    async def ainvoke(inputs, config=None):
+        # SQLite 호출은 busy timeout 동안 막힐 수 있으므로 이벤트 루프 밖에서 실행
+        key = make_key(inputs)
+        output = await asyncio.to_thread(cache.get, key)
+        if output is not None:
+            return output
+        output = await chain.ainvoke(inputs, config=config)
+        if is_valid(output):
+            await asyncio.to_thread(cache.put, key, output)
+        return output
+
+    return RunnableLambda(invoke, afunc=ainvoke)
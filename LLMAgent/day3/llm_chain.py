@@ -1,18 +1,43 @@
 from langchain import hub
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.output_parsers import JsonOutputParser, PydanticOutputParser, StrOutputParser
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field
+from typing import Literal
 import os
 
+from llm_cache import SQLiteResponseCache, cached_chain
+from resilience import dependencies, guard
+
 os.environ['OPENAI_API_KEY'] = '****'
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
+# 환경 변수로 이미 정했으면(예: benchmark는 false) 그대로 둔다
+os.environ.setdefault("LANGCHAIN_TRACING_V2", "true")
 os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
 os.environ["LANGCHAIN_API_KEY"] = "****"
 
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+# 모듈 import 시에는 prompt만 정의하고 LLM과 chain은 resources에서 처음 사용할 때 만든다
+CHAIN_NAMES = ("rag_chain", "retrieval_grade_chain", "answer_generation_chain", "hallucination_grader_chain", "answer_grade_chain", "answer_quality_chain")
+
+def build_llm():
+    # stream_usage: 스트리밍 중에도 토큰 사용량을 받아 계측에 사용
+    # 재시도는 resilience 정책이 하므로 클라이언트 자체 재시도는 끈다
+    return ChatOpenAI(model="gpt-4o-mini", temperature=0, stream_usage=True,
+                      timeout=dependencies["openai"].timeout, max_retries=0)
+
+def guarded(chain):
+    # 모든 LLM 호출에 timeout, 재시도, API key별 rate limit, circuit breaker를 적용
+    return guard(chain, dependencies["openai"], rate_key=os.environ.get("OPENAI_API_KEY"))
 
-rag_prompt = hub.pull("rlm/rag-prompt")
-rag_chain = rag_prompt | llm | StrOutputParser()
+def build_response_cache():
+    # temperature=0 grader 결과는 같은 입력이면 디스크 캐시에서 꺼내 쓴다
+    return SQLiteResponseCache()
+
+def pull_rag_prompt():
+    return hub.pull("rlm/rag-prompt")
+
+def build_rag_chain(llm, rag_prompt):
+    return guarded(rag_prompt | llm | StrOutputParser()).with_config(run_name="rag")
 
 retrieval_grade_prompt = ChatPromptTemplate.from_messages(
     [
@@ -25,7 +50,8 @@ retrieval_grade_prompt = ChatPromptTemplate.from_messages(
         ("human", "question: {question}\n\n document: {document} "),
     ]
 )
-retrieval_grade_chain = retrieval_grade_prompt | llm | JsonOutputParser()
+def build_retrieval_grade_chain(llm, response_cache):
+    return cached_chain(guarded(retrieval_grade_prompt | llm | JsonOutputParser()), retrieval_grade_prompt, llm, response_cache).with_config(run_name="retrieval_grade")
 
 answer_generation_prompt = ChatPromptTemplate.from_messages(
     [
@@ -35,7 +61,8 @@ answer_generation_prompt = ChatPromptTemplate.from_messages(
         ("human", "question: {question}\n\n context: {context} "),
     ]
 )
-answer_generation_chain = answer_generation_prompt | llm | StrOutputParser()
+def build_answer_generation_chain(llm):
+    return guarded(answer_generation_prompt | llm | StrOutputParser()).with_config(run_name="answer_generation")
 
 hallucination_prompt = ChatPromptTemplate.from_messages(
     [
@@ -46,7 +73,8 @@ hallucination_prompt = ChatPromptTemplate.from_messages(
         ("human", "documents: {documents}\n\n answer: {generation} "),
     ]
 )
-hallucination_grader_chain = hallucination_prompt | llm | JsonOutputParser()
+def build_hallucination_grader_chain(llm, response_cache):
+    return cached_chain(guarded(hallucination_prompt | llm | JsonOutputParser()), hallucination_prompt, llm, response_cache).with_config(run_name="hallucination_grader")
 
 answer_grade_prompt = ChatPromptTemplate.from_messages(
     [
@@ -56,4 +84,47 @@ answer_grade_prompt = ChatPromptTemplate.from_messages(
         ("human", "question: {question}\n\n answer: {generation} "),
     ]
 )
-answer_grade_chain = answer_grade_prompt | llm | JsonOutputParser()
\ No newline at end of file
+def build_answer_grade_chain(llm, response_cache):
+    return cached_chain(guarded(answer_grade_prompt | llm | JsonOutputParser()), answer_grade_prompt, llm, response_cache).with_config(run_name="answer_grade")
+
+class AnswerQuality(BaseModel):
+    """Groundedness and usefulness verdicts for one generated answer"""
+
+    grounded: Literal["yes", "no"] = Field(description="'yes' if every claim in the answer is supported by the documents")
+    useful: Literal["yes", "no"] = Field(description="'yes' if the answer resolves the question")
+
+answer_quality_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", """You are a grader checking a generated answer on two criteria.
+    grounded: 'yes' if the answer is supported by the documents, 'no' if it contains facts that are not in them.
+    useful: 'yes' if the answer resolves the question, 'no' if it does not address it or only says it does not know.
+    Give both verdicts as 'yes' or 'no'."""),
+        ("human", "question: {question}\n\n documents: {documents}\n\n answer: {generation} "),
+    ]
+)
+def build_answer_quality_chain(llm, response_cache):
+    # hallucination_grader와 answer_grade를 한 번의 호출로 합친 grader
+    prompt = answer_quality_prompt
+    try:
+        # OpenAI structured output은 응답이 스키마를 따르도록 보장한다
+        structured = llm.with_structured_output(AnswerQuality, method="json_schema")
+    except (NotImplementedError, ValueError):
+        # tool/structured output을 지원하지 않는 모델은 JSON 응답을 파싱해 검증하므로 형식을 prompt로 알려준다
+        parser = PydanticOutputParser(pydantic_object=AnswerQuality)
+        system, human = answer_quality_prompt.messages
+        prompt = ChatPromptTemplate.from_messages(
+            [("system", system.prompt.template + "\n    {format_instructions}"), human]
+        ).partial(format_instructions=parser.get_format_instructions())
+        structured = llm | parser
+    chain = prompt | structured | RunnableLambda(lambda grade: grade.model_dump())
+    return cached_chain(
+        guarded(chain), prompt, llm, response_cache,
+        is_valid=lambda output: isinstance(output, dict) and {"grounded", "useful"} <= set(output),
+    ).with_config(run_name="answer_quality")
+
+def __getattr__(name):
+    # 기존의 `from llm_chain import retrieval_grade_chain` 사용을 위해 resources에 위임
+    if name in CHAIN_NAMES or name in ("llm", "response_cache"):
+        from resources import resources
+        return resources.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,138 @@
+"""
+Near-duplicate detection for chunks
+
+SimHash fingerprints catch chunks that are almost identical (re-ingested posts,
+boilerplate repeated across pages, splitter overlap) at ingest, and mmr() re-ranks
+retrieval candidates so the k slots are not spent on overlapping passages.
+"""
+import hashlib
+from collections import defaultdict
+
+from keyword_index import tokenize
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+# 64비트 중 이 이하로 다르면 같은 chunk로 본다
+NEAR_DUPLICATE_DISTANCE = 4
+# 선택된 문서와 shingle이 이보다 많이 겹치는 후보는 MMR에서 뺀다
+MMR_MAX_OVERLAP = 0.5
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def simhash(text):
+    """
+    Returns:
+        int: 64-bit SimHash of the text's word shingles, None when the text has no words
+    """
+    text_shingles = shingles(text)
+    if not text_shingles:
+        # 빈 chunk끼리 모두 0으로 겹치지 않도록 fingerprint를 만들지 않는다
+        return None
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in text_shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SimHashIndex(object):
+    """
+    Finds a stored fingerprint within max_distance bits of a query
+
+    Fingerprints are split into max_distance + 1 bands; two fingerprints that differ
+    in at most max_distance bits share at least one band exactly, so only fingerprints
+    in the query's band buckets are compared.
+    """
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = -(-FINGERPRINT_BITS // self.bands)
+        self.buckets = defaultdict(set)
+        self.fingerprints = {}
+
+    def _keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(band, fingerprint >> (band * self.band_bits) & mask) for band in range(self.bands)]
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def add(self, key, fingerprint):
+        self.remove(key)
+        self.fingerprints[key] = fingerprint
+        for band_key in self._keys(fingerprint):
+            self.buckets[band_key].add(key)
+
+    def remove(self, key):
+        fingerprint = self.fingerprints.pop(key, None)
+        if fingerprint is None:
+            return
+        for band_key in self._keys(fingerprint):
+            self.buckets[band_key].discard(key)
+            if not self.buckets[band_key]:
+                del self.buckets[band_key]
+
+    def find(self, fingerprint):
+        """
+        Returns:
+            key of a near-duplicate fingerprint, None when there is none
+        """
+        for band_key in self._keys(fingerprint):
+            for key in self.buckets.get(band_key, ()):
+                if hamming(self.fingerprints[key], fingerprint) <= self.max_distance:
+                    return key
+        return None
+
+
+def mmr(documents, relevance, k, lambda_mult=0.7, max_overlap=MMR_MAX_OVERLAP):
+    """
+    Maximal marginal relevance over shingle overlap
+
+    Args:
+        documents (list): Candidates
+        relevance (list): Relevance per candidate, higher is better
+        k (int): Number of documents to select
+        lambda_mult (float): 1 ranks by relevance only, 0 by diversity only
+        max_overlap (float): Candidates sharing more than this Jaccard overlap with a
+            selected document are dropped as near-duplicates
+
+    Returns:
+        list: indices of the selected documents in selection order
+    """
+    if not documents:
+        return []
+    # 최댓값으로만 나눠 비율을 유지한다 (min-max로 펼치면 가장 낮은 후보가 0이 되어
+    # 겹치는 후보보다 뒤로 밀린다)
+    high = max(relevance)
+    relevance = [r / high if high > 0 else 1.0 for r in relevance]
+    shingle_sets = [shingles(doc.page_content) for doc in documents]
+    redundancy = [0.0] * len(documents)
+    selected = []
+    remaining = set(range(len(documents)))
+    while remaining and len(selected) < k:
+        best = max(remaining, key=lambda i: (lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy[i], -i))
+        selected.append(best)
+        remaining.discard(best)
+        for i in list(remaining):
+            redundancy[i] = max(redundancy[i], jaccard(shingle_sets[i], shingle_sets[best]))
+            if redundancy[i] > max_overlap:
+                remaining.discard(i)
+    return selected
@@ -1,8 +1,16 @@
 from langchain_openai import ChatOpenAI
+import asyncio
 import os
 from pprint import pprint
 
-from user_langgraph import workflow
+from resources import resources
+from answer_cache import build_answer_cache
+from checkpoint_store import message_sources, pending_question, thread_config
+from instrumentation import format_summary, metrics
+from user_langgraph import initial_state
+
+# 같은 thread_id로 다시 실행하면 대화 기록과 중단된 실행이 이어진다
+THREAD_ID = os.environ.get("RAG_THREAD_ID", "cli")
 
 def format_final_result_advanced(final_result):
     """고급 포맷팅으로 최종 결과 출력"""
@@ -84,15 +92,100 @@ def format_final_result_advanced(final_result):
         else:
             print(f"\n📚 참조 문서: 없음")
 
-def main():
-    app = workflow.compile()
+async def run_question(app, question, inputs, thread_id=THREAD_ID):
+    """비동기로 그래프를 실행하며 노드 진행 상황과 답변 토큰을 실시간 출력 (inputs가 None이면 마지막 checkpoint부터 재개)"""
+    final_result = None
+    step_count = 0
+    streaming = False
+    tracer = metrics.tracer(question=question)
+    config = thread_config(thread_id, callbacks=[tracer])
+    
+    # updates: 노드 완료, messages: generate 노드의 LLM 토큰
+    async for mode, payload in app.astream(inputs, config=config, stream_mode=["updates", "messages"]):
+        if mode == "messages":
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") != "generate" or not chunk.content:
+                continue
+            if not streaming:
+                print("\n💬 답변 (검증 중): ", end="", flush=True)
+                streaming = True
+            print(chunk.content, end="", flush=True)
+            continue
+        
+        if streaming:
+            print()
+            streaming = False
+        for key, value in payload.items():
+            final_result = value
+            step_count += 1
+            
+            step_emoji = {
+                'retrieve': '🔍 문서 검색',
+                'grade_documents': '✅ 문서 평가', 
+                'websearch': '🌐 웹 검색',
+                'generate': '🤖 답변 생성',
+                'hallucination_check': '🔍 품질 검사',
+                'keep_answer': '↩️ 이전 답변 유지'
+            }
+            
+            step_name = step_emoji.get(key, f'⚙️ {key}')
+            print(f"[{step_count}] {step_name}... 완료")
+            
+            # 품질 검사 결과에 따라 임시 답변 확정 또는 철회
+            if key == 'hallucination_check':
+                if value.get('hallucination') == 'Yes':
+                    print("⚠️ 답변이 문서에 근거하지 않아 철회합니다.")
+                elif value.get('useful') == 'No':
+                    print("⚠️ 답변이 질문을 해결하지 못했습니다.")
+                else:
+                    print("✅ 답변이 검증되었습니다.")
+    
+    # 노드별 소요 시간, LLM 호출 수, 토큰 사용량
+    print("-" * 60)
+    print(format_summary(tracer.finish()))
+    return final_result
+
+async def answer_question(app, conversations, question, inputs):
+    """그래프를 실행하고, 실패하면 다음 시작 때 같은 실행을 다시 재개하지 않도록 checkpoint를 버린다"""
+    try:
+        return await run_question(app, question, inputs)
+    except Exception as e:
+        print(f"\n❌ 답변 생성 중 오류가 발생했습니다: {e!r}")
+        conversations.discard_run(THREAD_ID)
+        return {"generation": f"failed: {e!r}", "documents": []}
+
+def finish_turn(conversations, final_result):
+    """답변을 대화 기록에 남기고 오래된 checkpoint를 정리"""
+    final_result = final_result or {}
+    conversations.append(
+        THREAD_ID, "assistant", final_result.get("generation") or "답변을 생성할 수 없습니다.",
+        message_sources(final_result.get("documents")),
+    )
+    conversations.trim(THREAD_ID)
+
+async def amain():
+    # 캐시된 LLM 클라이언트는 처음 사용한 이벤트 루프에 묶이므로 세션 전체를 하나의 루프에서 실행한다
+    # 질문을 입력하는 동안 인덱스와 클라이언트를 미리 준비
+    resources.warm_up()
+    app = resources.get("chat_app")
+    conversations = resources.get("conversations")
+    answer_cache = build_answer_cache()
+
+    # 이전 실행이 중간에 끊겼다면 마지막으로 완료된 노드부터 이어서 실행
+    pending = pending_question(app, THREAD_ID)
+    if pending:
+        print(f"\n♻️ 중단된 질문을 이어서 처리합니다: {pending}")
+        final_result = await answer_question(app, conversations, pending, None)
+        answer_cache.store(pending, final_result)
+        finish_turn(conversations, final_result)
+        format_final_result_advanced(final_result)
 
     while True:
         print("\n" + "🌟 " + "="*56 + " 🌟")
         print("                      AI 질의응답 시스템")
         print("🌟 " + "="*56 + " 🌟")
         
-        question = input("\n🔍 질문을 입력하세요 (종료: exit): ")
+        question = await asyncio.to_thread(input, "\n🔍 질문을 입력하세요 (종료: exit): ")
         
         if question == "exit":
             print("\n👋 프로그램을 종료합니다. 감사합니다!")
@@ -100,41 +193,29 @@ def main():
         if question == "":
             continue
 
-        inputs = {
-            "question": question, 
-            "web_search": "No", 
-            "web_search_count": 0, 
-            "hallucination": "No", 
-            "hallucination_check_count": 0, 
-            "documents": []
-        }
-
         print(f"\n📝 입력된 질문: {question}")
+        conversations.append(THREAD_ID, "user", question)
+        
+        # 비슷한 질문에 대한 답변이 캐시에 있으면 그래프를 실행하지 않는다
+        cached, vector = answer_cache.lookup(question)
+        if cached:
+            print(f"💾 캐시된 답변을 사용합니다 (유사도: {cached['similarity']:.3f})")
+            finish_turn(conversations, cached)
+            format_final_result_advanced(cached)
+            continue
+        
         print("⏳ AI가 답변을 생성하고 있습니다...")
         print("-" * 60)
         
-        final_result = None
-        step_count = 0
-        
-        # 노드 실행 과정 표시
-        for output in app.stream(inputs):
-            for key, value in output.items():
-                final_result = value
-                step_count += 1
-                
-                step_emoji = {
-                    'retrieve': '🔍 문서 검색',
-                    'grade_documents': '✅ 문서 평가', 
-                    'websearch': '🌐 웹 검색',
-                    'generate': '🤖 답변 생성',
-                    'hallucination_check': '🔍 품질 검사'
-                }
-                
-                step_name = step_emoji.get(key, f'⚙️ {key}')
-                print(f"[{step_count}] {step_name}... 완료")
+        final_result = await answer_question(app, conversations, question, initial_state(question))
+        answer_cache.store(question, final_result, vector)
+        finish_turn(conversations, final_result)
         
         # 최종 결과를 고급 포맷팅으로 출력
         format_final_result_advanced(final_result)
 
+def main():
+    asyncio.run(amain())
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
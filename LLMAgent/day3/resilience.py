@@ -0,0 +1,383 @@
+"""
+Timeouts, retries, rate limits and circuit breakers for external calls
+
+Every outbound dependency (OpenAI, Tavily, fetching source pages) goes through a
+Dependency policy:
+
+- the per-call timeout is passed to the client (and enforced with wait_for on the async path)
+- retryable failures (timeouts, connection errors, 429, 5xx) are retried with jittered exponential backoff
+- a token bucket per API key (per host for page fetches) and a concurrency limit add backpressure
+- consecutive failed calls (after their retries) open the circuit breaker of that API key
+  or host, which fails fast with CircuitOpenError until reset_timeout has passed; then a
+  single probe call decides whether it closes again
+
+The graph checks available() to degrade instead of waiting, e.g. skipping the web
+search and answering from the retrieved documents while Tavily is down.
+"""
+import asyncio
+import random
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
+
+try:
+    from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+except ImportError:  # custom event가 없는 langchain_core에서는 재시도를 callback으로 알리지 않는다
+    adispatch_custom_event = dispatch_custom_event = None
+
+# 예외 클래스 이름으로 판별해서 openai, requests, httpx를 import하지 않아도 된다
+RETRYABLE_ERRORS = frozenset((
+    "Timeout", "ConnectTimeout", "ReadTimeout", "TimeoutException", "ConnectionError", "ConnectError",
+    "APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError",
+))
+
+# 재시도마다 실행 중인 runnable(그래프 노드)의 callback으로 보내는 custom event 이름
+RETRY_EVENT = "dependency_retry"
+
+# dependency별 정책: timeout(초), 재시도, 동시 호출 수, 초당 호출 수(token bucket)
+POLICIES = {
+    "openai": {"timeout": 30, "max_attempts": 3, "max_concurrency": 16, "rate": 10, "burst": 20},
+    "tavily": {"timeout": 10, "max_attempts": 2, "max_concurrency": 4, "rate": 2, "burst": 5},
+    "web": {"timeout": 15, "max_attempts": 3, "max_concurrency": 8, "rate": 5, "burst": 10},
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose circuit breaker is open"""
+
+
+def is_retryable(error):
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+def retry_after(error):
+    # 429/503 응답의 Retry-After(초)를 따른다
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    """
+    Token bucket allowing rate calls per second with bursts up to capacity
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self):
+        # 토큰을 하나 가져가고 기다려야 할 시간을 돌려준다 (음수 잔고는 예약)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker(object):
+    """
+    Opens after failure_threshold consecutive failures and lets one probe through after reset_timeout
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class Dependency(object):
+    """
+    Resilience policy shared by every call to one external dependency
+
+    Token buckets and circuit breakers are kept per rate key (API key, or host for page
+    fetches), so one dead host does not fail calls to the others. A call counts as one
+    failure for its breaker only after all its attempts failed.
+
+    Args:
+        name (str): Dependency name, used in log lines
+        timeout (float): Per-attempt timeout in seconds
+        max_attempts (int): Attempts per call including the first
+        base_delay (float): Backoff before the second attempt; doubles per attempt
+        max_delay (float): Upper bound of a single backoff
+        max_concurrency (int): Calls in flight at once
+        rate (float): Calls per second per rate key (API key or host)
+        burst (int): Token bucket capacity
+        failure_threshold (int): Consecutive failed calls that open a rate key's breaker
+        reset_timeout (float): Seconds a breaker stays open before a probe
+    """
+
+    def __init__(self, name, timeout=30.0, max_attempts=3, base_delay=0.5, max_delay=8.0, max_concurrency=None,
+                 rate=None, burst=None, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate = rate
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def _breaker(self, rate_key):
+        with self.lock:
+            if rate_key not in self.breakers:
+                self.breakers[rate_key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[rate_key]
+
+    def available(self, rate_key=None):
+        """
+        Whether a call with rate_key would be let through; without a key, whether no breaker is open
+        """
+        if rate_key is not None:
+            return self._breaker(rate_key).state != "open"
+        with self.lock:
+            breakers = list(self.breakers.values())
+        # API key가 하나뿐인 openai/tavily는 key 없이 물어도 그 breaker의 상태가 된다
+        return all(breaker.state != "open" for breaker in breakers)
+
+    def _bucket(self, rate_key):
+        if not self.rate:
+            return None
+        with self.lock:
+            if rate_key not in self.buckets:
+                self.buckets[rate_key] = TokenBucket(self.rate, self.burst)
+            return self.buckets[rate_key]
+
+    def _backoff(self, attempt, error):
+        # full jitter: 0 ~ min(max_delay, base_delay * 2^attempt)
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        hint = retry_after(error)
+        return min(self.max_delay, max(delay, hint)) if hint else delay
+
+    def _retry_event(self, attempt, error):
+        return {"dependency": self.name, "attempt": attempt + 1, "error": repr(error)}
+
+    def _admit(self, rate_key):
+        # 재시도는 같은 호출의 일부이므로 breaker는 호출마다 한 번만 확인한다
+        breaker = self._breaker(rate_key)
+        if not breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} circuit is open" + (f" for {rate_key}" if rate_key else ""))
+        self.calls += 1
+        return breaker
+
+    def _should_retry(self, attempt, error, can_retry):
+        if not is_retryable(error):
+            return False
+        print(f"---{self.name.upper()} CALL FAILED ({attempt + 1}/{self.max_attempts}): {error!r}---")
+        return attempt + 1 < self.max_attempts and (can_retry is None or can_retry())
+
+    def _finish_failed(self, breaker, error):
+        # 재시도할 수 없는 에러(400 등)는 dependency 장애로 보지 않는다
+        if not is_retryable(error):
+            breaker.record_success()
+            return
+        self.failures += 1
+        breaker.record_failure()
+
+    def call(self, fn, *args, rate_key=None, can_retry=None, **kwargs):
+        """
+        Call fn(*args, **kwargs) under this policy; the caller passes self.timeout to the client
+
+        can_retry, if given, is asked before each retry, e.g. to stop once output was streamed
+        """
+        breaker = self._admit(rate_key)
+        bucket = self._bucket(rate_key)
+        for attempt in range(self.max_attempts):
+            if bucket:
+                bucket.acquire()
+            if self.semaphore:
+                self.semaphore.acquire()
+            try:
+                result, error = fn(*args, **kwargs), None
+            except Exception as e:
+                result, error = None, e
+            finally:
+                if self.semaphore:
+                    self.semaphore.release()
+            if error is None:
+                breaker.record_success()
+                return result
+            if not self._should_retry(attempt, error, can_retry):
+                self._finish_failed(breaker, error)
+                raise error
+            # 대기하는 동안에는 동시 호출 슬롯을 잡고 있지 않는다
+            self.retries += 1
+            if dispatch_custom_event is not None:
+                try:
+                    dispatch_custom_event(RETRY_EVENT, self._retry_event(attempt, error))
+                except RuntimeError:
+                    # runnable 밖(수집, 백그라운드 갱신)에서 호출되면 알릴 run이 없다
+                    pass
+            time.sleep(self._backoff(attempt, error))
+
+    async def acall(self, fn, *args, rate_key=None, can_retry=None, **kwargs):
+        """
+        Async variant of call; fn returns an awaitable, which is also bounded by self.timeout
+        """
+        breaker = self._admit(rate_key)
+        bucket = self._bucket(rate_key)
+        for attempt in range(self.max_attempts):
+            if bucket:
+                await bucket.aacquire()
+            if self.semaphore:
+                # threading 세마포어를 이벤트 루프에서 막히지 않게 얻는다
+                while not self.semaphore.acquire(blocking=False):
+                    await asyncio.sleep(0.01)
+            try:
+                result, error = await asyncio.wait_for(fn(*args, **kwargs), self.timeout), None
+            except Exception as e:
+                result, error = None, e
+            finally:
+                if self.semaphore:
+                    self.semaphore.release()
+            if error is None:
+                breaker.record_success()
+                return result
+            if not self._should_retry(attempt, error, can_retry):
+                self._finish_failed(breaker, error)
+                raise error
+            self.retries += 1
+            if adispatch_custom_event is not None:
+                try:
+                    await adispatch_custom_event(RETRY_EVENT, self._retry_event(attempt, error))
+                except RuntimeError:
+                    pass
+            await asyncio.sleep(self._backoff(attempt, error))
+
+    def stats(self):
+        with self.lock:
+            states = [breaker.state for breaker in self.breakers.values()]
+        # 가장 나쁜 breaker 상태를 dependency의 상태로 보고한다
+        state = next((s for s in ("open", "half_open") if s in states), "closed")
+        return {
+            "state": state,
+            "open_circuits": states.count("open"),
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+class TokenWatch(BaseCallbackHandler):
+    """
+    Callback handler remembering whether an LLM already streamed a token to the callbacks
+    """
+    # 토큰 callback은 이벤트 루프에서 바로 실행해야 실패 시점에 값이 맞다
+    run_inline = True
+
+    def __init__(self):
+        self.streamed = False
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.streamed = True
+
+
+def with_handler(config, handler):
+    # config의 callbacks가 list이든 callback manager이든 handler를 하나 더 붙인다
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if callbacks is None:
+        callbacks = [handler]
+    elif isinstance(callbacks, list):
+        callbacks = callbacks + [handler]
+    else:
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+    config["callbacks"] = callbacks
+    return config
+
+
+def guard(runnable, dependency, rate_key=None):
+    """
+    Wrap a chain so invoke/ainvoke/batch/abatch go through dependency
+
+    A call whose LLM already streamed tokens is not retried: the tokens were sent to the
+    stream's consumer and a second attempt would send the answer again.
+
+    Returns:
+        Runnable: chain with the same interface
+    """
+    def invoke(inputs, config=None):
+        watch = TokenWatch()
+        return dependency.call(runnable.invoke, inputs, config=with_handler(config, watch), rate_key=rate_key,
+                               can_retry=lambda: not watch.streamed)
+
+    async def ainvoke(inputs, config=None):
+        watch = TokenWatch()
+        return await dependency.acall(runnable.ainvoke, inputs, config=with_handler(config, watch), rate_key=rate_key,
+                                      can_retry=lambda: not watch.streamed)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+
+dependencies = {name: Dependency(name, **policy) for name, policy in POLICIES.items()}
@@ -0,0 +1,168 @@
+import threading
+from contextlib import contextmanager
+
+import checkpoint_store
+import grade_policy
+import llm_chain
+import web_retriever
+from search_cache import CachedSearch, SearchCache
+from search_client import AsyncTavily
+
+TAVILY_API_KEY = '****'
+
+
+# 서버 시작 시 미리 만들어 둘 resource (의존하는 resource도 함께 만들어진다)
+WARM_UP = ("app", "chat_app", "conversations", "retriever", "retrieval_grade_chain", "answer_generation_chain", "answer_quality_chain", "web_search")
+
+
+class Resources(object):
+    """
+    Lazily built, overridable shared resources (LLM, retriever, search client, chains)
+
+    Each resource is created by its provider on first get() and reused afterwards, so
+    every thread and Streamlit session in the process shares one instance. Providers
+    receive the container so they can depend on other resources. Each resource has its
+    own build lock: concurrent first calls build it once, and a slow build (the
+    vectorstore) does not block unrelated resources.
+    """
+
+    def __init__(self, providers):
+        self.providers = dict(providers)
+        self.instances = {}
+        self.lock = threading.RLock()
+        self.build_locks = {}
+        self.warm_up_thread = None
+        self.warm_up_error = None
+
+    def _build_lock(self, name):
+        with self.lock:
+            return self.build_locks.setdefault(name, threading.RLock())
+
+    def get(self, name):
+        try:
+            return self.instances[name]
+        except KeyError:
+            pass
+        with self._build_lock(name):
+            if name not in self.instances:
+                with self.lock:
+                    if name not in self.providers:
+                        raise KeyError(f"unknown resource: {name}")
+                    provider = self.providers[name]
+                instance = provider(self)
+                with self.lock:
+                    self.instances[name] = instance
+            return self.instances[name]
+
+    def is_ready(self, *names):
+        return all(name in self.instances for name in (names or WARM_UP))
+
+    def warm_up(self, names=WARM_UP, background=True, strict=False):
+        """
+        Build resources ahead of the first request; calling it again is a no-op
+
+        Args:
+            names (tuple): Resources to build
+            background (bool): Build in a daemon thread and return immediately
+            strict (bool): Raise the first build error instead of only recording it (foreground only)
+
+        Returns:
+            threading.Thread: the warm-up thread, None when run in the foreground
+        """
+        def run():
+            try:
+                for name in names:
+                    self.get(name)
+            except Exception as e:
+                # 실패해도 첫 요청에서 다시 만들어 볼 수 있도록 기록만 한다
+                self.warm_up_error = e
+                print(f"---WARM UP FAILED: {e!r}---")
+                if strict:
+                    raise
+
+        if not background:
+            run()
+            return None
+        with self.lock:
+            if self.warm_up_thread is None:
+                self.warm_up_thread = threading.Thread(target=run, name="resources-warm-up", daemon=True)
+                self.warm_up_thread.start()
+            return self.warm_up_thread
+
+    def provide(self, name, provider):
+        # provider가 바뀌면 이를 사용해 만들어진 resource도 다시 만들어야 한다
+        with self.lock:
+            self.providers[name] = provider
+            self.instances.clear()
+
+    def set(self, name, instance):
+        with self.lock:
+            self.instances[name] = instance
+
+    def reset(self, *names):
+        with self.lock:
+            if names:
+                for name in names:
+                    self.instances.pop(name, None)
+            else:
+                self.instances.clear()
+
+    @contextmanager
+    def override(self, **instances):
+        """
+        Temporarily replace resources with ready-made instances, e.g. fakes in benchmarks
+        """
+        with self.lock:
+            saved_providers = dict(self.providers)
+            saved_instances = dict(self.instances)
+            self.instances.clear()
+            for name, instance in instances.items():
+                self.providers[name] = lambda r, instance=instance: instance
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.providers = saved_providers
+                self.instances = saved_instances
+
+
+def compile_workflow(r, checkpointer=None):
+    # user_langgraph가 resources를 import하므로 여기서 늦게 import한다
+    from user_langgraph import workflow
+    return workflow.compile(checkpointer=checkpointer)
+
+
+DEFAULT_PROVIDERS = {
+    "app": compile_workflow,
+    # 대화형 front end용: thread_id별로 노드마다 checkpoint를 남겨 중단된 실행을 이어서 한다
+    "chat_app": lambda r: compile_workflow(r, r.get("checkpointer")),
+    "checkpointer": lambda r: checkpoint_store.build_checkpointer(),
+    "conversations": lambda r: checkpoint_store.build_conversation_store(),
+    "llm": lambda r: llm_chain.build_llm(),
+    "response_cache": lambda r: llm_chain.build_response_cache(),
+    "rag_prompt": lambda r: llm_chain.pull_rag_prompt(),
+    "rag_chain": lambda r: llm_chain.build_rag_chain(r.get("llm"), r.get("rag_prompt")),
+    "retrieval_grade_chain": lambda r: llm_chain.build_retrieval_grade_chain(r.get("llm"), r.get("response_cache")),
+    "answer_generation_chain": lambda r: llm_chain.build_answer_generation_chain(r.get("llm")),
+    "hallucination_grader_chain": lambda r: llm_chain.build_hallucination_grader_chain(r.get("llm"), r.get("response_cache")),
+    "answer_grade_chain": lambda r: llm_chain.build_answer_grade_chain(r.get("llm"), r.get("response_cache")),
+    "answer_quality_chain": lambda r: llm_chain.build_answer_quality_chain(r.get("llm"), r.get("response_cache")),
+    "embeddings": lambda r: web_retriever.build_embeddings(),
+    "session": lambda r: web_retriever.new_session(),
+    "url_list": lambda r: list(web_retriever.URL_LIST),
+    "keyword_index": lambda r: web_retriever.load_keyword_index(),
+    "vectorstore": lambda r: web_retriever.web_retrieve(
+        r.get("url_list"), embeddings=r.get("embeddings"), session=r.get("session"),
+        keyword_index=r.get("keyword_index"),
+    ),
+    "retriever": lambda r: web_retriever.build_retriever(r.get("vectorstore"), r.get("keyword_index")),
+    # 웹 검색 결과를 수집할 때 이미 저장된 chunk와 거의 같은 결과를 거른다
+    "near_index": lambda r: web_retriever.load_near_index(r.get("vectorstore")),
+    "tavily": lambda r: AsyncTavily(api_key=TAVILY_API_KEY),
+    "search_cache": lambda r: SearchCache(),
+    # 노드는 tavily를 직접 부르지 않고 캐시를 거친다
+    "web_search": lambda r: CachedSearch(r.get("tavily"), r.get("search_cache")),
+    "grade_thresholds": lambda r: grade_policy.load_thresholds(),
+}
+
+resources = Resources(DEFAULT_PROVIDERS)
@@ -0,0 +1,149 @@
+"""
+Persistent cache of web search results
+
+Results are keyed on the normalized query (case, Unicode form, whitespace and
+trailing punctuation do not matter) plus the search options. An entry is fresh for
+ttl seconds; after that it is still served for up to stale_ttl seconds while one
+background refresh replaces it (stale-while-revalidate), and keeps being served if
+that refresh fails. Storage and LRU eviction are shared with llm_cache.SQLiteResponseCache.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_cache import SQLiteResponseCache
+from resilience import dependencies
+
+SEARCH_CACHE_PATH = os.environ.get(
+    "SEARCH_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_cache.sqlite"),
+)
+SEARCH_CACHE_TTL = 6 * 60 * 60
+SEARCH_CACHE_STALE_TTL = 3 * 24 * 60 * 60
+
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search-refresh")
+
+
+def normalize_query(query):
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip("?!.。 ")
+
+
+def cache_key(query, options):
+    payload = {"query": normalize_query(query), "options": options}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class SearchCache(SQLiteResponseCache):
+    """
+    SQLite store of search responses, served fresh for ttl seconds and stale up to stale_ttl
+    """
+
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, stale_ttl=SEARCH_CACHE_STALE_TTL,
+                 max_entries=10000):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.stale_hits = 0
+        super(SearchCache, self).__init__(path, max_entries, table="search_results")
+
+    def contains(self, key):
+        # 조회 통계와 LRU 순서를 바꾸지 않고 쓸 수 있는 결과가 있는지만 본다
+        entry = self._read(key, touch=False)
+        return entry is not None and time.time() - entry[1] <= self.stale_ttl
+
+    def get(self, key):
+        """
+        Returns:
+            tuple: (response, fresh) or None when there is no entry younger than stale_ttl
+        """
+        now = time.time()
+        entry = self._read(key)
+        with self.lock:
+            if entry is None or now - entry[1] > self.stale_ttl:
+                self.misses += 1
+                return None
+            fresh = now - entry[1] <= self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+        return entry[0], fresh
+
+    def _evict(self, conn, now):
+        conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.stale_ttl,))
+        super(SearchCache, self)._evict(conn, now)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            "size": self.size(),
+        }
+
+
+class CachedSearch(object):
+    """
+    Search client (search/asearch like AsyncTavily) answering repeated queries from a SearchCache
+    """
+
+    def __init__(self, client, cache, dependency=None):
+        self.client = client
+        self.cache = cache
+        self.dependency = dependency or dependencies["tavily"]
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def available(self, query):
+        # circuit이 열려 있어도 캐시에 있으면 검색 결과를 줄 수 있다
+        return self.dependency.available() or self.cache.contains(cache_key(query, {}))
+
+    def _refresh(self, key, query, kwargs):
+        try:
+            self.cache.put(key, self.client.search(query=query, **kwargs))
+        except Exception as e:
+            print(f"---SEARCH CACHE REFRESH FAILED: {e!r}---")
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def _lookup(self, query, kwargs):
+        key = cache_key(query, kwargs)
+        cached = self.cache.get(key)
+        if cached is None:
+            return key, None
+        response, fresh = cached
+        if not fresh:
+            # 오래된 결과를 바로 돌려주고 한 번만 백그라운드로 갱신
+            with self.lock:
+                start = key not in self.refreshing and self.dependency.available()
+                if start:
+                    self.refreshing.add(key)
+            if start:
+                _refresh_pool.submit(self._refresh, key, query, kwargs)
+        return key, response
+
+    def search(self, query, **kwargs):
+        key, response = self._lookup(query, kwargs)
+        if response is not None:
+            return response
+        response = self.client.search(query=query, **kwargs)
+        self.cache.put(key, response)
+        return response
+
+    async def asearch(self, query, **kwargs):
+        key, response = await asyncio.to_thread(self._lookup, query, kwargs)
+        if response is not None:
+            return response
+        response = await self.client.asearch(query=query, **kwargs)
+        await asyncio.to_thread(self.cache.put, key, response)
+        return response
@@ -0,0 +1,36 @@
+import asyncio
+
+from tavily import TavilyClient
+
+from resilience import dependencies
+
+try:
+    from tavily import AsyncTavilyClient
+except ImportError:  # 오래된 tavily-python에는 비동기 클라이언트가 없다
+    AsyncTavilyClient = None
+
+
+class AsyncTavily(object):
+    """
+    Non-blocking wrapper around the Tavily search API
+
+    Uses AsyncTavilyClient when the installed tavily-python provides it, otherwise
+    runs the blocking TavilyClient.search in a worker thread so the event loop keeps going.
+    Calls go through the "tavily" resilience policy, rate limited per API key.
+    """
+
+    def __init__(self, api_key, dependency=None):
+        self.api_key = api_key
+        self.dependency = dependency or dependencies["tavily"]
+        self.client = TavilyClient(api_key=api_key)
+        self.async_client = AsyncTavilyClient(api_key=api_key) if AsyncTavilyClient else None
+
+    def search(self, query, **kwargs):
+        kwargs.setdefault("timeout", self.dependency.timeout)
+        return self.dependency.call(self.client.search, query=query, rate_key=self.api_key, **kwargs)
+
+    async def asearch(self, query, **kwargs):
+        kwargs.setdefault("timeout", self.dependency.timeout)
+        if self.async_client is not None:
+            return await self.dependency.acall(self.async_client.search, query=query, rate_key=self.api_key, **kwargs)
+        return await self.dependency.acall(asyncio.to_thread, self.client.search, query=query, rate_key=self.api_key, **kwargs)
@@ -0,0 +1,422 @@
+"""
+Headless HTTP/JSON server for the RAG workflow
+
+A pool of worker processes runs the compiled workflow; each worker opens the same
+persisted Chroma index, which the server builds once before starting them (and exits
+if that fails). Requests wait in a bounded queue: when QUEUE_SIZE requests are already
+waiting the server answers 503 with Retry-After instead of letting latency grow without
+bound. A worker that dies is restarted after RESTART_DELAY seconds; the request it was
+running fails with 503.
+
+    python serve.py --port 8000 --workers 4 --queue-size 16
+
+    POST /ask      {"question": "...", "stream": false, "thread_id": null}
+                   stream=true returns newline-delimited JSON events as they happen:
+                   node, token, retract, result, error
+    GET  /healthz  200 once every worker is ready
+    GET  /metrics  queue depth, in-flight requests, admissions and rejections, and the
+                   per-node metrics of every finished request (Prometheus text)
+
+Requests with a thread_id run on the checkpointed chat workflow; send one request
+per thread at a time.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORKERS = max(1, (os.cpu_count() or 2) // 2)
+QUEUE_SIZE = 16
+REQUEST_TIMEOUT = 120
+# 죽은 worker를 확인하는 주기와 다시 띄우기까지 기다리는 시간(초)
+SUPERVISE_INTERVAL = 1.0
+RESTART_DELAY = 5.0
+
+
+def run_request(resources, request):
+    """
+    Run one request through the graph, yielding the events streamed to the client
+    """
+    from checkpoint_store import message_sources, thread_config
+    from instrumentation import metrics
+    from user_langgraph import initial_state
+
+    question = request["question"]
+    thread_id = request.get("thread_id")
+    tracer = metrics.tracer(question=question)
+    if thread_id:
+        app, config = resources.get("chat_app"), thread_config(thread_id, callbacks=[tracer])
+    else:
+        app, config = resources.get("app"), {"callbacks": [tracer]}
+
+    final = {}
+    for mode, payload in app.stream(initial_state(question), config=config, stream_mode=["updates", "messages"]):
+        if mode == "messages":
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") == "generate" and chunk.content:
+                yield {"event": "token", "content": chunk.content}
+            continue
+        for node, value in payload.items():
+            final.update(value or {})
+            yield {"event": "node", "node": node}
+            # 검증에 실패한 답변은 클라이언트가 지우도록 알린다
+            if node == "hallucination_check" and (value.get("hallucination") == "Yes" or value.get("useful") == "No"):
+                yield {"event": "retract"}
+    # 노드별 계측은 부모 프로세스가 모아 /metrics로 내보낸다
+    yield {"event": "trace", "summary": tracer.summary(), "durations": list(tracer.durations)}
+    yield {"event": "result", "generation": final.get("generation"),
+           "documents": message_sources(final.get("documents"))}
+
+
+def worker_main(jobs, events, cancelled, verbose=False):
+    # spawn으로 시작하므로 무거운 모듈은 worker 안에서 import한다
+    from resources import resources
+    import web_retriever
+
+    # 인덱스는 부모 프로세스가 만들어 두었으므로 worker는 저장된 인덱스를 열기만 한다
+    resources.provide("vectorstore", lambda r: web_retriever.load_vectorstore(embeddings=r.get("embeddings")))
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        try:
+            resources.warm_up(background=False, strict=True)
+        except Exception as e:
+            # ready를 보내지 않고 끝내면 supervisor가 잠시 뒤 다시 띄운다
+            events.put((None, {"event": "failed", "pid": os.getpid(), "error": repr(e)}))
+            sys.exit(1)
+        events.put((None, {"event": "ready", "pid": os.getpid()}))
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            request_id, request = job
+            # 기다리다 timeout되거나 연결이 끊긴 요청은 실행하지 않는다
+            if cancelled.pop(request_id, None) is not None:
+                events.put((request_id, {"event": "skipped"}))
+                continue
+            events.put((request_id, {"event": "started", "pid": os.getpid()}))
+            try:
+                for event in run_request(resources, request):
+                    events.put((request_id, event))
+            except Exception as e:
+                events.put((request_id, {"event": "error", "error": repr(e)}))
+            events.put((request_id, {"event": "done"}))
+
+
+class WorkerPool(object):
+    """
+    Worker processes fed from a bounded job queue, with events routed back per request
+
+    Admission counts requests waiting for a worker, including ones whose client gave up:
+    those stay queued until a worker takes the job and skips it through the shared
+    cancelled dict. In-flight requests are the ones a worker has started, tracked by its pid. A dispatcher thread moves worker events to
+    the waiting request handler, and a supervisor thread restarts workers that died,
+    failing the request each one was running.
+    """
+
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, verbose=False):
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.queue_size = queue_size
+        self.verbose = verbose
+        # 자리가 없으면 admission 단계에서 거절하므로 job queue는 넉넉하게 둔다
+        self.jobs = self.context.Queue()
+        self.events = self.context.Queue()
+        self.manager = self.context.Manager()
+        self.cancelled = self.manager.dict()
+        self.processes = [None] * workers
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.ready_pids = set()
+        self.waiting = set()
+        self.running = {}
+        self.stopping = False
+        self.counts = {"ok": 0, "error": 0, "rejected": 0, "timeout": 0}
+        self.restarts = 0
+        self.duration = 0.0
+        self.dispatcher = threading.Thread(target=self._dispatch, name="event-dispatcher", daemon=True)
+        self.supervisor = threading.Thread(target=self._supervise, name="worker-supervisor", daemon=True)
+
+    @property
+    def ready(self):
+        return len(self.ready_pids)
+
+    def _spawn(self, slot):
+        process = self.context.Process(target=worker_main, args=(self.jobs, self.events, self.cancelled, self.verbose),
+                                       daemon=True)
+        process.start()
+        self.processes[slot] = process
+
+    def start(self):
+        for slot in range(self.workers):
+            self._spawn(slot)
+        self.dispatcher.start()
+        self.supervisor.start()
+
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+        for _ in self.processes:
+            self.jobs.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+        self.manager.shutdown()
+
+    def _dispatch(self):
+        from instrumentation import metrics
+
+        while True:
+            request_id, event = self.events.get()
+            if event["event"] == "trace":
+                # worker의 tracer 요약을 이 프로세스의 registry에 합친다 (trace 파일도 여기서 한 번만 쓴다)
+                metrics.record(event["summary"], event["durations"])
+                continue
+            with self.lock:
+                if request_id is None:
+                    if event["event"] == "ready":
+                        self.ready_pids.add(event["pid"])
+                    else:
+                        print(f"---WORKER {event['pid']} WARM-UP FAILED: {event['error']}---")
+                    continue
+                if event["event"] == "skipped":
+                    self.waiting.discard(request_id)
+                    continue
+                channel = self.channels.get(request_id)
+                if event["event"] == "started":
+                    self.waiting.discard(request_id)
+                    self.running[request_id] = event["pid"]
+                    if channel is None:
+                        # 취소 표시 전에 worker가 이미 시작했으면 표시를 지운다
+                        self.cancelled.pop(request_id, None)
+                elif event["event"] == "done":
+                    self.running.pop(request_id, None)
+            if channel is not None:
+                channel.put(event)
+
+    def _supervise(self):
+        dead_since = {}
+        while True:
+            time.sleep(SUPERVISE_INTERVAL)
+            for slot, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                with self.lock:
+                    if self.stopping:
+                        return
+                if slot not in dead_since:
+                    dead_since[slot] = time.monotonic()
+                    self._worker_died(process)
+                elif time.monotonic() - dead_since[slot] >= RESTART_DELAY:
+                    # 바로 다시 띄우지 않아 warm-up이 계속 실패할 때 재시작이 반복되지 않게 한다
+                    del dead_since[slot]
+                    with self.lock:
+                        self.restarts += 1
+                    self._spawn(slot)
+
+    def _worker_died(self, process):
+        print(f"---WORKER {process.pid} EXITED WITH {process.exitcode}, RESTARTING IN {RESTART_DELAY:.0f}s---")
+        with self.lock:
+            self.ready_pids.discard(process.pid)
+            lost = [request_id for request_id, pid in self.running.items() if pid == process.pid]
+            channels = []
+            for request_id in lost:
+                del self.running[request_id]
+                channels.append(self.channels.get(request_id))
+        for channel in channels:
+            if channel is not None:
+                channel.put({"event": "error", "error": "worker exited", "status": 503})
+                channel.put({"event": "done"})
+
+    def submit(self, request):
+        """
+        Returns:
+            tuple: (request_id, channel of events) or None when the queue is full
+        """
+        with self.lock:
+            if len(self.waiting) >= self.queue_size:
+                self.counts["rejected"] += 1
+                return None
+            request_id = uuid.uuid4().hex
+            self.waiting.add(request_id)
+            channel = queue.Queue()
+            self.channels[request_id] = channel
+        self.jobs.put((request_id, request))
+        return request_id, channel
+
+    def events_for(self, request_id, channel, started, timeout=REQUEST_TIMEOUT):
+        # done 이벤트까지 전달하고, 시간이 넘으면 timeout 이벤트로 끝낸다
+        status = "ok"
+        try:
+            while True:
+                remaining = timeout - (time.monotonic() - started)
+                try:
+                    event = channel.get(timeout=max(0.0, remaining))
+                except queue.Empty:
+                    status = "timeout"
+                    yield {"event": "error", "error": "timeout", "status": 504}
+                    return
+                if event["event"] == "started":
+                    continue
+                if event["event"] == "done":
+                    return
+                if event["event"] == "error":
+                    status = "error"
+                yield event
+        finally:
+            with self.lock:
+                # 늦게 끝난 worker의 이벤트는 버린다
+                self.channels.pop(request_id, None)
+                if request_id in self.waiting:
+                    # 시작도 못 한 요청은 worker가 꺼낼 때까지 대기열에 남겨 두고 실행만 건너뛰게 한다
+                    self.cancelled[request_id] = True
+                self.counts[status] += 1
+                self.duration += time.monotonic() - started
+
+    def render_prometheus(self):
+        with self.lock:
+            lines = [
+                "# TYPE rag_server_queue_depth gauge",
+                f"rag_server_queue_depth {len(self.waiting)}",
+                "# TYPE rag_server_queue_capacity gauge",
+                f"rag_server_queue_capacity {self.queue_size}",
+                "# TYPE rag_server_in_flight gauge",
+                f"rag_server_in_flight {len(self.running)}",
+                "# TYPE rag_server_workers_ready gauge",
+                f"rag_server_workers_ready {len(self.ready_pids)}",
+                "# TYPE rag_server_worker_restarts_total counter",
+                f"rag_server_worker_restarts_total {self.restarts}",
+                "# TYPE rag_server_requests_total counter",
+            ]
+            for status, count in sorted(self.counts.items()):
+                lines.append(f'rag_server_requests_total{{status="{status}"}} {count}')
+            lines.append("# TYPE rag_server_request_duration_seconds_sum counter")
+            lines.append(f"rag_server_request_duration_seconds_sum {self.duration:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    pool = None
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            ready = self.pool.ready >= self.pool.workers
+            self._send_json(200 if ready else 503, {"ready": ready, "workers_ready": self.pool.ready})
+        elif self.path == "/metrics":
+            from instrumentation import metrics
+            # dependency 통계는 worker 프로세스마다 따로 있으므로 여기서는 내보내지 않는다
+            text = self.pool.render_prometheus() + metrics.render_prometheus(include_dependencies=False)
+            data = text.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/ask":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            request = None
+        # 배열이나 문자열 같은 JSON도 500이 아니라 400으로 거절한다
+        question = request.get("question") if isinstance(request, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            self._send_json(400, {"error": "body must be JSON with a non-empty 'question'"})
+            return
+
+        started = time.monotonic()
+        submitted = self.pool.submit({"question": question.strip(), "thread_id": request.get("thread_id")})
+        if submitted is None:
+            # 대기열이 가득 차면 바로 거절해서 대기 시간이 끝없이 늘지 않게 한다
+            self._send_json(503, {"error": "server busy"}, headers={"Retry-After": "1"})
+            return
+        events = self.pool.events_for(*submitted, started)
+
+        if request.get("stream"):
+            # HTTP/1.0 응답이므로 연결을 닫을 때까지 이벤트를 한 줄씩 보낸다
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            try:
+                for event in events:
+                    self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                events.close()
+            return
+
+        result, error, nodes = None, None, []
+        for event in events:
+            if event["event"] == "node":
+                nodes.append(event["node"])
+            elif event["event"] == "retract":
+                nodes.append("retract")
+            elif event["event"] == "result":
+                result = event
+            elif event["event"] == "error":
+                error = event
+        if error is not None:
+            self._send_json(error.get("status", 500), {"error": error["error"]})
+        else:
+            self._send_json(200, {"generation": result["generation"], "documents": result["documents"], "steps": nodes})
+
+    def log_message(self, format, *args):
+        # 요청 로그는 한 줄로 남긴다
+        print(f"---HTTP {self.address_string()} {format % args}---")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the RAG workflow over HTTP/JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="requests allowed to wait for a worker")
+    parser.add_argument("--verbose", action="store_true", help="keep the graph's own print output in workers")
+    args = parser.parse_args(argv)
+
+    # 인덱스는 여기서 한 번만 만들거나 갱신하고, worker는 저장된 인덱스를 연다
+    # 만들지 못하면 worker마다 따로 수집하지 않도록 서버를 띄우지 않는다
+    from resources import resources
+    try:
+        resources.warm_up(("vectorstore",), background=False, strict=True)
+    except Exception as e:
+        raise SystemExit(f"---INDEX WARM-UP FAILED, NOT STARTING: {e!r}---")
+
+    pool = WorkerPool(args.workers, args.queue_size, args.verbose)
+    pool.start()
+    RequestHandler.pool = pool
+    server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+    server.daemon_threads = True
+    print(f"---SERVING ON http://{args.host}:{args.port} WITH {args.workers} WORKERS---")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 import streamlit as st
 import time
+import uuid
 from datetime import datetime
-from user_langgraph import workflow
+from resources import resources
+from answer_cache import build_answer_cache
+from checkpoint_store import message_sources, pending_question, thread_config
+from instrumentation import metrics
+from user_langgraph import initial_state
 
 # 페이지 설정
 st.set_page_config(
@@ -66,16 +71,33 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# 그래프, 인덱스, 클라이언트는 프로세스 전체에서 공유하고 첫 실행 때 백그라운드로 준비
+resources.warm_up()
+
+@st.cache_resource
+def get_answer_cache():
+    # 모든 세션이 같은 답변 캐시를 공유
+    return build_answer_cache()
+
+answer_cache = get_answer_cache()
+
+# 대화는 URL의 thread id로 구분되어 새로고침이나 서버 재시작 후에도 이어진다
+if "thread" not in st.query_params:
+    st.query_params["thread"] = uuid.uuid4().hex
+thread_id = st.query_params["thread"]
+conversations = resources.get("conversations")
+
 # 세션 상태 초기화
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-if "workflow_app" not in st.session_state:
-    st.session_state.workflow_app = workflow.compile()
+if st.session_state.get("thread_id") != thread_id:
+    st.session_state.thread_id = thread_id
+    st.session_state.messages = conversations.messages(thread_id)
 
 # 사이드바 - 설정 및 정보
 with st.sidebar:
     st.header("📊 챗봇 정보")
     st.info("이 챗봇은 문서 검색과 웹 검색을 통해 정확한 답변을 제공합니다.")
+    if not resources.is_ready():
+        st.warning("⏳ 검색 인덱스를 준비 중입니다. 첫 답변이 늦을 수 있습니다.")
     
     st.header("🔧 설정")
     show_steps = st.checkbox("처리 단계 표시", value=True)
@@ -83,9 +105,17 @@ with st.sidebar:
     
     st.header("📈 통계")
     st.metric("총 대화 수", len(st.session_state.messages) // 2)
+    cache_stats = answer_cache.stats()
+    st.metric("캐시 적중률", f"{cache_stats['hit_rate']:.0%}")
+    st.caption(f"캐시 크기 {cache_stats['size']} · 제거 {cache_stats['evictions']}")
+    search_stats = resources.get("search_cache").stats()
+    st.caption(f"웹 검색 캐시 적중률 {search_stats['hit_rate']:.0%} · 크기 {search_stats['size']}")
+    with st.expander("📉 노드별 메트릭"):
+        st.code(metrics.render_prometheus(), language="text")
     
     # 초기화 버튼
     if st.button("🗑️ 대화 기록 초기화"):
+        conversations.clear(thread_id)
         st.session_state.messages = []
         st.rerun()
 
@@ -133,73 +163,107 @@ with st.form("chat_form", clear_on_submit=True):
     user_input = st.text_input("질문을 입력하세요:", placeholder="예: 머신러닝이 무엇인가요?")
     submit_button = st.form_submit_button("📤 전송")
 
+# 이전 실행이 중간에 끊겼다면 마지막으로 완료된 노드부터 이어서 실행
+app = resources.get("chat_app")
+pending = None if submit_button and user_input else pending_question(app, thread_id)
+
 # 질문 처리
-if submit_button and user_input:
-    # 사용자 메시지 추가
-    st.session_state.messages.append({"role": "user", "content": user_input})
+if (submit_button and user_input) or pending:
+    if pending:
+        # 질문은 이미 대화 기록에 있다
+        user_input = pending
+        inputs = None
+    else:
+        # 사용자 메시지 추가
+        st.session_state.messages.append({"role": "user", "content": user_input})
+        conversations.append(thread_id, "user", user_input)
+        inputs = initial_state(user_input)
     
     # 처리 중 표시
     with st.spinner("🤖 AI가 답변을 생성 중입니다..."):
-        # 입력 데이터 준비
-        inputs = {
-            "question": user_input,
-            "web_search": "No",
-            "web_search_count": 0,
-            "hallucination": "No", 
-            "hallucination_check_count": 0,
-            "documents": []
-        }
-        
         # 단계별 처리 표시
         if show_steps:
             step_placeholder = st.empty()
             steps_completed = []
         
-        final_result = None
+        final_result, vector = (None, None) if pending else answer_cache.lookup(user_input)
+        
+        # 답변 토큰 실시간 표시
+        answer_placeholder = st.empty()
+        streamed_answer = ""
         
-        # 워크플로우 실행
-        for output in st.session_state.workflow_app.stream(inputs):
-            for key, value in output.items():
-                final_result = value
+        # 워크플로우 실행 (캐시 적중 시 생략)
+        tracer = metrics.tracer(question=user_input)
+        stream = [] if final_result else app.stream(
+            inputs, config=thread_config(thread_id, callbacks=[tracer]), stream_mode=["updates", "messages"]
+        )
+        try:
+            for mode, output in stream:
+                if mode == "messages":
+                    chunk, metadata = output
+                    if metadata.get("langgraph_node") == "generate" and chunk.content:
+                        streamed_answer += chunk.content
+                        answer_placeholder.markdown(f"""
+                        <div class="chat-message bot-message">
+                            <strong>🤖 AI (검증 중):</strong><br>
+                            {streamed_answer}▌
+                        </div>
+                        """, unsafe_allow_html=True)
+                    continue
+            
+                for key, value in output.items():
+                    final_result = value
                 
-                if show_steps:
-                    step_emoji = {
-                        'retrieve': '🔍 문서 검색',
-                        'grade_documents': '✅ 문서 평가',
-                        'websearch': '🌐 웹 검색', 
-                        'generate': '🤖 답변 생성',
-                        'hallucination_check': '🔍 품질 검사'
-                    }
+                    # 품질 검사 결과에 따라 임시 답변 확정 또는 철회
+                    if key == 'hallucination_check':
+                        if value.get('hallucination') == 'Yes':
+                            answer_placeholder.warning("⚠️ 답변이 문서에 근거하지 않아 철회했습니다. 다시 생성합니다...")
+                        elif value.get('useful') == 'No':
+                            answer_placeholder.warning("⚠️ 답변이 질문을 해결하지 못했습니다. 추가 자료를 확인합니다...")
+                        else:
+                            answer_placeholder.empty()
+                        streamed_answer = ""
+                
+                    if show_steps:
+                        step_emoji = {
+                            'retrieve': '🔍 문서 검색',
+                            'grade_documents': '✅ 문서 평가',
+                            'websearch': '🌐 웹 검색', 
+                            'generate': '🤖 답변 생성',
+                            'hallucination_check': '🔍 품질 검사',
+                            'keep_answer': '↩️ 이전 답변 유지'
+                        }
                     
-                    step_name = step_emoji.get(key, f'⚙️ {key}')
-                    steps_completed.append(f"✅ {step_name}")
+                        step_name = step_emoji.get(key, f'⚙️ {key}')
+                        steps_completed.append(f"✅ {step_name}")
                     
-                    step_placeholder.markdown(f"""
-                    <div class="step-indicator">
-                        <strong>처리 단계:</strong><br>
-                        {' → '.join(steps_completed)}
-                    </div>
-                    """, unsafe_allow_html=True)
+                        step_placeholder.markdown(f"""
+                        <div class="step-indicator">
+                            <strong>처리 단계:</strong><br>
+                            {' → '.join(steps_completed)}
+                        </div>
+                        """, unsafe_allow_html=True)
+        except Exception as e:
+            # 같은 오류로 페이지를 열 때마다 다시 재개하지 않도록 중단된 실행을 버린다
+            conversations.discard_run(thread_id)
+            st.error(f"답변 생성 중 오류가 발생했습니다: {e!r}")
+            final_result = {"generation": f"failed: {e!r}", "documents": []}
         
         # 처리 단계 표시 제거
         if show_steps:
             step_placeholder.empty()
+        answer_placeholder.empty()
+        
+        if final_result and "similarity" not in final_result:
+            answer_cache.store(user_input, final_result, vector)
+            tracer.finish()
     
     # 결과 처리
     if final_result and isinstance(final_result, dict):
         answer = final_result.get('generation', '답변을 생성할 수 없습니다.')
         
         # 참조 문서 정보 추출
-        sources = []
-        if 'documents' in final_result:
-            for doc in final_result['documents']:
-                metadata = getattr(doc, 'metadata', {})
-                sources.append({
-                    'title': metadata.get('title', '제목 없음'),
-                    'url': metadata.get('url', '#'),
-                    'source': metadata.get('source', 'vectorstore'),
-                    'score': metadata.get('score', 'N/A')
-                })
+        sources = message_sources(final_result.get('documents'))
         
         # AI 응답 추가
         st.session_state.messages.append({
@@ -207,6 +271,8 @@ if submit_button and user_input:
             "content": answer,
             "sources": sources
         })
+        conversations.append(thread_id, "assistant", answer, sources)
+        conversations.trim(thread_id)
     
     # 페이지 새로고침
     st.rerun()
@@ -1,20 +1,21 @@
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
-from typing import List
+from typing import Any, Dict, List
 
 from langchain_core.documents import Document
+from langchain_core.exceptions import OutputParserException
 from typing_extensions import TypedDict
 
-from web_retriever import retriever
-from langchain import hub
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, START, END
 
-from llm_chain import rag_chain,retrieval_grade_chain, answer_generation_chain, hallucination_grader_chain, answer_grade_chain
-
-from tavily import TavilyClient
-tavily = TavilyClient(api_key='****')
+# retriever, web_search, chain은 노드가 처음 실행될 때 resources에서 만들어진다
+from resources import resources
+import grade_policy
+from context_builder import build_context
+from web_retriever import ingest_web_results
 
 class GraphState(TypedDict):
     """
@@ -26,7 +27,13 @@ class GraphState(TypedDict):
         web_search: whether to add search
         web_search_count: number of web searches
         hallucination_check_count: number of hallucination checks
+        useful: whether the answer resolves the question
         documents: list of documents
+        web_results: Tavily results fetched speculatively during grading
+        grades: relevance grade per document content hash
+        hallucination_grades: groundedness and usefulness grades per (generation, documents) hash
+        context: packed prompt context built from documents by generate
+        fallback: grounded but unhelpful answer with its documents, kept while searching the web for a better one
     """
 
     question: str
@@ -35,7 +42,39 @@ class GraphState(TypedDict):
     web_search_count: int = 0
     hallucination: str
     hallucination_check_count: int = 0
+    useful: str
     documents: List[Document]
+    web_results: List[dict]
+    grades: Dict[str, str]
+    hallucination_grades: Dict[str, Dict[str, str]]
+    context: str
+    fallback: Dict[str, Any]
+
+def initial_state(question):
+    """
+    Input state for a new question
+
+    Every per-question key is reset, so a thread checkpointed with a previous question
+    does not carry its grades, context or web results over.
+    """
+    return {
+        "question": question,
+        "generation": "",
+        "web_search": "No",
+        "web_search_count": 0,
+        "hallucination": "No",
+        "hallucination_check_count": 0,
+        "useful": "Yes",
+        "documents": [],
+        "web_results": [],
+        "grades": {},
+        "hallucination_grades": {},
+        "context": "",
+        "fallback": {},
+    }
+
+def document_key(doc):
+    return hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()[:16]
 
 ### Nodes
 def retrieve(state):
@@ -52,7 +91,20 @@ def retrieve(state):
     question = state["question"]
 
     # Retrieval
-    documents = retriever.invoke(question)
+    documents = resources.get("retriever").invoke(question)
+    print(question)
+    print(documents)
+    return {"documents": documents, "question": question}
+
+async def aretrieve(state):
+    """
+    Async variant of retrieve
+    """
+    print("---RETRIEVE---")
+    question = state["question"]
+
+    # Retrieval
+    documents = await resources.get("retriever").ainvoke(question)
     print(question)
     print(documents)
     return {"documents": documents, "question": question}
@@ -71,39 +123,160 @@ def generate(state):
     question = state["question"]
     documents = state["documents"]
 
-    # RAG generation
-    generation = answer_generation_chain.invoke({"context": documents, "question": question})
-    return {"documents": documents, "question": question, "generation": generation}
+    # RAG generation (중복 제거, 관련도 정렬, 토큰 예산에 맞춘 context)
+    context = build_context(documents)
+    generation = resources.get("answer_generation_chain").invoke({"context": context, "question": question})
+    return {"documents": documents, "question": question, "generation": generation, "context": context}
 
+async def agenerate(state):
+    """
+    Async variant of generate
+    """
+    print("---GENERATE---")
+    question = state["question"]
+    documents = state["documents"]
 
-def grade_documents(state):
+    # RAG generation (중복 제거, 관련도 정렬, 토큰 예산에 맞춘 context)
+    context = build_context(documents)
+    generation = await resources.get("answer_generation_chain").ainvoke({"context": context, "question": question})
+    return {"documents": documents, "question": question, "generation": generation, "context": context}
+
+
+# 문서 평가 병렬 처리 설정
+GRADE_PARALLEL = True
+GRADE_MAX_CONCURRENCY = 6
+# 관련 없는 문서가 하나라도 나오면 라우팅이 결정되므로 남은 평가를 취소
+# (async는 실행 중인 호출도 취소하고, sync는 GRADE_MAX_CONCURRENCY개 단위 wave 사이에서 멈춘다)
+GRADE_EARLY_EXIT = False
+# 첫 평가와 동시에 웹 검색을 시작하고 websearch로 라우팅될 때만 결과를 사용
+SPECULATIVE_WEB_SEARCH = False
+
+_speculative_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative-search")
+
+# 관련 있다고 평가된 웹 검색 결과를 로컬 인덱스에 넣어 다음 질문은 로컬 검색으로 찾게 한다
+INGEST_WEB_RESULTS = False
+WEB_INGEST_MIN_SCORE = 0.5
+
+_ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="web-ingest")
+
+def _parse_grade(score):
+    if isinstance(score, Exception):
+        print(f"---GRADE: ERROR {score!r}---")
+        return "error"
+    try:
+        return score["score"].lower()
+    except (KeyError, TypeError, AttributeError):
+        print(f"---GRADE: UNPARSEABLE {score!r}---")
+        return "error"
+
+def grade_document_batch(question, documents, max_concurrency=GRADE_MAX_CONCURRENCY, early_exit=GRADE_EARLY_EXIT):
     """
-    Determines whether the retrieved documents are relevant to the question
-    If any document is not relevant, we will set a flag to run web search
+    Grade documents concurrently, keeping the result order of the input
 
     Args:
-        state (dict): The current graph state
+        question (str): The user question
+        documents (list): Documents to grade
+        max_concurrency (int): Maximum number of grading calls in flight
+        early_exit (bool): Stop grading after the first wave of max_concurrency documents
+            that contains an irrelevant one
 
     Returns:
-        state (dict): Filtered out irrelevant documents and updated web_search state
+        list: "yes", "no" or "error" per document, None for documents left ungraded by early exit
     """
+    inputs = [{"question": question, "document": d.page_content} for d in documents]
+    if not early_exit:
+        scores = resources.get("retrieval_grade_chain").batch(
+            inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True
+        )
+        return [_parse_grade(score) for score in scores]
+
+    # 동기 호출은 시작하면 취소할 수 없으므로 max_concurrency개씩 나눠 보내고 wave 사이에서 멈춘다
+    grades = [None] * len(inputs)
+    wave_size = max(1, max_concurrency)
+    for start in range(0, len(inputs), wave_size):
+        scores = resources.get("retrieval_grade_chain").batch(
+            inputs[start:start + wave_size], config={"max_concurrency": wave_size}, return_exceptions=True
+        )
+        grades[start:start + len(scores)] = [_parse_grade(score) for score in scores]
+        if any(grade != "yes" for grade in grades[start:start + len(scores)]):
+            print("---GRADE: EARLY EXIT---")
+            break
+    return grades
 
-    print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
+async def agrade_document_batch(question, documents, max_concurrency=GRADE_MAX_CONCURRENCY, early_exit=GRADE_EARLY_EXIT):
+    """
+    Async variant of grade_document_batch; early exit cancels the calls still in flight
+    """
+    inputs = [{"question": question, "document": d.page_content} for d in documents]
+    if not early_exit:
+        scores = await resources.get("retrieval_grade_chain").abatch(
+            inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True
+        )
+        return [_parse_grade(score) for score in scores]
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def grade_one(x):
+        async with semaphore:
+            return await resources.get("retrieval_grade_chain").ainvoke(x)
+
+    grades = [None] * len(inputs)
+    tasks = {asyncio.ensure_future(grade_one(x)): i for i, x in enumerate(inputs)}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            exit_now = False
+            for task in done:
+                grade = _parse_grade(task.exception() or task.result())
+                grades[tasks[task]] = grade
+                exit_now = exit_now or grade != "yes"
+            if exit_now:
+                print("---GRADE: EARLY EXIT---")
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+    return grades
+
+def _split_graded(state, documents):
+    # 이미 평가한 문서(content hash 기준)는 저장된 결과를 쓰고 새 문서만 평가한다
+    stored = dict(state.get("grades") or {})
+    known = [stored.get(document_key(d)) for d in documents]
+    pending = [d for d, grade in zip(documents, known) if grade is None]
+    if len(pending) < len(documents):
+        print(f"---GRADE: REUSING {len(documents) - len(pending)} STORED GRADES---")
+    return stored, known, pending
+
+def _store_grades(stored, known, pending, pending_grades):
+    # early exit로 평가하지 않은 문서와 에러는 저장하지 않아 다음에 다시 평가된다
+    for d, grade in zip(pending, pending_grades):
+        if grade in ("yes", "no"):
+            stored[document_key(d)] = grade
+    pending_grades = iter(pending_grades)
+    return [grade if grade is not None else next(pending_grades) for grade in known]
+
+def _web_search_available(state):
+    return bool(state.get("web_results")) or resources.get("web_search").available(state["question"])
+
+def _should_speculate(state):
+    return (SPECULATIVE_WEB_SEARCH and state.get("web_search_count", 0) == 0
+            and resources.get("web_search").available(state["question"]))
+
+def _filter_graded(state, documents, grades):
     question = state["question"]
-    documents = state["documents"]
-
-    # Score each doc
     filtered_docs = []
     web_search = "No"
-    for d in documents:
-        score = retrieval_grade_chain.invoke(
-            {"question": question, "document": d.page_content}
-        )
-        grade = score["score"]
+    for d, grade in zip(documents, grades):
         # Document relevant
-        if grade.lower() == "yes":
+        if grade == "yes":
             print("---GRADE: DOCUMENT RELEVANT---")
             filtered_docs.append(d)
+        # Not graded because of early exit
+        elif grade is None:
+            # 웹 검색 뒤 다시 평가될 때만 남기고, 검색할 수 없으면 평가되지 않은 채 generate로 가지 않게 버린다
+            if state.get("web_search_count", 0) == 0 and _web_search_available(state):
+                filtered_docs.append(d)
         # Document not relevant
         else:
             print("---GRADE: DOCUMENT NOT RELEVANT---")
@@ -111,11 +284,125 @@ def grade_documents(state):
             # We set a flag to indicate that we want to run web search
             web_search = "Yes"
             continue
-    if web_search == "Yes":
+    # 관련 문서가 하나도 없으면 generate로 가지 않는다 (웹 검색 뒤에는 남은 관련 문서로 답변한다)
+    if not filtered_docs or (web_search == "Yes" and state.get("web_search_count", 0) == 0):
         return {"documents": filtered_docs, "question": question, "web_search": web_search, "generation":"failed: not relevant"}
     else:
         return {"documents": filtered_docs, "question": question, "web_search": web_search}
 
+def _early_exit(state):
+    # 웹 검색 뒤에는 모든 문서를 평가해야 남은 관련 문서로 답변할 수 있다
+    return GRADE_EARLY_EXIT and state.get("web_search_count", 0) == 0
+
+def _prefilter_grades(documents, early_exit):
+    # 유사도 점수로 판정이 명확한 문서는 LLM에 묻지 않는다
+    pre_grades = grade_policy.prefilter(documents, resources.get("grade_thresholds"))
+    uncertain = [d for d, grade in zip(documents, pre_grades) if grade is None]
+    auto = len(documents) - len(uncertain)
+    if auto:
+        print(f"---GRADE: {auto} DOCUMENTS DECIDED BY SIMILARITY SCORE---")
+    # 이미 관련 없는 문서가 있으면 early exit에서는 라우팅이 정해졌으므로 LLM 평가를 생략
+    skip_llm = early_exit and "no" in pre_grades
+    return pre_grades, uncertain, skip_llm
+
+def _merge_grades(question, pre_grades, uncertain, llm_grades):
+    grade_policy.log_decisions(question, uncertain, llm_grades)
+    llm_grades = iter(llm_grades)
+    return [grade if grade is not None else next(llm_grades) for grade in pre_grades]
+
+def grade_documents(state):
+    """
+    Determines whether the retrieved documents are relevant to the question
+    If any document is not relevant, we will set a flag to run web search
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Filtered out irrelevant documents and updated web_search state
+    """
+
+    print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
+    question = state["question"]
+    documents = state["documents"]
+    stored, known, pending = _split_graded(state, documents)
+
+    speculative = None
+    if _should_speculate(state):
+        speculative = _speculative_pool.submit(resources.get("web_search").search, query=question)
+
+    # Score each doc
+    early_exit = _early_exit(state)
+    pre_grades, uncertain, skip_llm = _prefilter_grades(pending, early_exit)
+    if skip_llm:
+        llm_grades = [None] * len(uncertain)
+    elif GRADE_PARALLEL:
+        llm_grades = grade_document_batch(question, uncertain, early_exit=early_exit)
+    else:
+        llm_grades = grade_document_batch(question, uncertain, max_concurrency=1, early_exit=early_exit)
+    grades = _store_grades(stored, known, pending, _merge_grades(question, pre_grades, uncertain, llm_grades))
+    result = _filter_graded(state, documents, grades)
+    result["grades"] = stored
+    _ingest_relevant_web_results(result["documents"])
+
+    if speculative is not None:
+        if result["web_search"] == "Yes":
+            try:
+                result["web_results"] = speculative.result()["results"]
+            except Exception as e:
+                # websearch 노드에서 다시 검색한다
+                print(f"---SPECULATIVE WEB SEARCH FAILED: {e!r}---")
+        else:
+            print("---SPECULATIVE WEB SEARCH DISCARDED---")
+            speculative.cancel()
+    return result
+
+async def agrade_documents(state):
+    """
+    Async variant of grade_documents
+    """
+
+    print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
+    question = state["question"]
+    documents = state["documents"]
+    stored, known, pending = _split_graded(state, documents)
+
+    speculative = None
+    # available()은 검색 캐시(SQLite)를 볼 수 있으므로 이벤트 루프 밖에서 확인
+    if await asyncio.to_thread(_should_speculate, state):
+        speculative = asyncio.ensure_future(resources.get("web_search").asearch(query=question))
+
+    try:
+        # Score each doc
+        early_exit = _early_exit(state)
+        pre_grades, uncertain, skip_llm = _prefilter_grades(pending, early_exit)
+        if skip_llm:
+            llm_grades = [None] * len(uncertain)
+        elif GRADE_PARALLEL:
+            llm_grades = await agrade_document_batch(question, uncertain, early_exit=early_exit)
+        else:
+            llm_grades = await agrade_document_batch(question, uncertain, max_concurrency=1, early_exit=early_exit)
+    except BaseException:
+        if speculative is not None:
+            speculative.cancel()
+        raise
+    grades = _store_grades(stored, known, pending, _merge_grades(question, pre_grades, uncertain, llm_grades))
+    result = _filter_graded(state, documents, grades)
+    result["grades"] = stored
+    _ingest_relevant_web_results(result["documents"])
+
+    if speculative is not None:
+        if result["web_search"] == "Yes":
+            try:
+                result["web_results"] = (await speculative)["results"]
+            except Exception as e:
+                # websearch 노드에서 다시 검색한다
+                print(f"---SPECULATIVE WEB SEARCH FAILED: {e!r}---")
+        else:
+            print("---SPECULATIVE WEB SEARCH DISCARDED---")
+            speculative.cancel()
+    return result
+
 
 def web_search(state):
     """
@@ -135,26 +422,102 @@ def web_search(state):
     if "documents" in state:
       documents = state["documents"]
 
-    # Web search
-    docs = tavily.search(query=question)['results']
+    # Web search (평가 중에 미리 받아둔 결과가 있으면 사용)
+    try:
+        docs = state.get("web_results") or resources.get("web_search").search(query=question)['results']
+    except Exception as e:
+        return _skip_web_search(question, documents, e)
+    return _append_web_results(question, documents, docs)
 
-    web_results = "\n".join([d["content"] for d in docs])
-    web_results = Document(page_content=web_results, metadata={"url": docs[0]["url"], "title": docs[0]["title"]})
-    if documents is not None:
-        documents.append(web_results)
-    else:
-        documents = [web_results]
-    return {"documents": documents, "question": question, "web_search_count": 1}
+async def aweb_search(state):
+    """
+    Async variant of web_search
+    """
+
+    print("---WEB SEARCH---")
+    print(state)
+    question = state["question"]
+    documents = None
+    if "documents" in state:
+      documents = state["documents"]
+
+    # Web search (평가 중에 미리 받아둔 결과가 있으면 사용)
+    try:
+        docs = state.get("web_results") or (await resources.get("web_search").asearch(query=question))['results']
+    except Exception as e:
+        return _skip_web_search(question, documents, e)
+    return _append_web_results(question, documents, docs)
+
+def _skip_web_search(question, documents, error):
+    # 재시도 후에도 실패하거나 circuit이 열려 있으면 검색된 문서만으로 답변한다
+    print(f"---WEB SEARCH UNAVAILABLE: {error!r}---")
+    return {"documents": documents or [], "question": question, "web_search_count": 1, "web_results": []}
+
+def _append_web_results(question, documents, docs):
+    # 검색 결과마다 자신의 url, title, score를 가진 Document로 만들어 따로 평가한다
+    web_results = [
+        Document(page_content=d["content"], metadata={
+            "url": d.get("url"), "title": d.get("title"), "score": d.get("score"), "source": "web",
+        })
+        for d in docs if d.get("content")
+    ]
+    documents = list(documents or []) + web_results
+    return {"documents": documents, "question": question, "web_search_count": 1, "web_results": []}
+
+def _ingest_relevant_web_results(documents):
+    if not INGEST_WEB_RESULTS:
+        return
+    relevant = [d for d in documents if d.metadata.get("source") == "web"
+                and (d.metadata.get("score") or 0) >= WEB_INGEST_MIN_SCORE]
+    if relevant:
+        # 답변을 기다리게 하지 않도록 백그라운드에서 임베딩
+        _ingest_pool.submit(_run_web_ingest, relevant)
+
+def _run_web_ingest(documents):
+    try:
+        ids = ingest_web_results(documents, resources.get("vectorstore"), resources.get("keyword_index"),
+                                 resources.get("near_index"))
+        print(f"---WEB RESULTS INGESTED: {len(ids)}---")
+    except Exception as e:
+        print(f"---WEB RESULTS INGEST FAILED: {e!r}---")
 
 def hallucination_check(state):
     """
-    Check hallucination
+    Check whether the answer is grounded in the documents and resolves the question
+
+    Both verdicts come from a single answer_quality_chain call.
 
     Args:
         state (dict): The current graph state
 
     Returns:
-        state (dict): New key added to state, hallucination, that contains hallucination result
+        state (dict): New keys added to state, hallucination and useful, that contain the grading result
+    """
+
+    print("---HALLUCINATION CHECK---")
+
+    documents = state["documents"]
+    generation = state["generation"]
+    hallucination_check_count = state["hallucination_check_count"]
+
+    key, stored = _hallucination_key(state)
+    if key in stored:
+        print("---HALLUCINATION CHECK: REUSING STORED GRADE---")
+        grade = stored[key]
+    else:
+        # generate에서 만든 context를 그대로 사용
+        try:
+            grade = resources.get("answer_quality_chain").invoke(
+                {"question": state["question"], "documents": state.get("context") or build_context(documents), "generation": generation}
+            )
+        except OutputParserException as e:
+            # 파싱할 수 없는 응답은 _parse_quality에서 판정 불가로 처리한다
+            grade = e.llm_output
+    return _hallucination_result(grade, documents, generation, hallucination_check_count, key, stored)
+
+async def ahallucination_check(state):
+    """
+    Async variant of hallucination_check
     """
 
     print("---HALLUCINATION CHECK---")
@@ -163,20 +526,77 @@ def hallucination_check(state):
     generation = state["generation"]
     hallucination_check_count = state["hallucination_check_count"]
 
-    score = hallucination_grader_chain.invoke(
-        {"documents": documents, "generation": generation}
-    )
-    grade = score["score"]
+    key, stored = _hallucination_key(state)
+    if key in stored:
+        print("---HALLUCINATION CHECK: REUSING STORED GRADE---")
+        grade = stored[key]
+    else:
+        # generate에서 만든 context를 그대로 사용
+        try:
+            grade = await resources.get("answer_quality_chain").ainvoke(
+                {"question": state["question"], "documents": state.get("context") or build_context(documents), "generation": generation}
+            )
+        except OutputParserException as e:
+            # 파싱할 수 없는 응답은 _parse_quality에서 판정 불가로 처리한다
+            grade = e.llm_output
+    return _hallucination_result(grade, documents, generation, hallucination_check_count, key, stored)
+
+def _hallucination_key(state):
+    # 재생성된 답변이 이전과 같고 문서도 같으면 이전 판정을 그대로 쓴다
+    digest = hashlib.sha256(state["generation"].encode("utf-8"))
+    for d in state["documents"]:
+        digest.update(document_key(d).encode("utf-8"))
+    return digest.hexdigest()[:16], dict(state.get("hallucination_grades") or {})
+
+def _parse_quality(grade):
+    # 판정을 읽을 수 없으면 근거 없음으로 보고 재생성한다 (재생성 횟수는 제한됨)
+    try:
+        grounded = grade["grounded"].lower()
+        useful = grade["useful"].lower()
+    except (KeyError, TypeError, AttributeError):
+        print(f"---HALLUCINATION CHECK: UNPARSEABLE {grade!r}---")
+        return {"grounded": "no", "useful": "yes"}
+    return {"grounded": grounded, "useful": useful}
+
+def _hallucination_result(grade, documents, generation, hallucination_check_count, key, stored):
+    grade = _parse_quality(grade)
+    stored[key] = grade
+    useful = "Yes" if grade["useful"] == "yes" else "No"
 
     # Check hallucination
-    if grade == "no":
+    if grade["grounded"] == "yes":
         print("---DECISION: GENERATION IS GROUNDED IN DOCUMENTS---")
-        return {"hallucination": "No", "generation": generation, "hallucination_check_count": hallucination_check_count + 1, "documents": documents}
+        result = {"hallucination": "No", "useful": useful, "generation": generation, "hallucination_check_count": hallucination_check_count + 1, "documents": documents, "hallucination_grades": stored}
+        if useful == "No":
+            print("---DECISION: GENERATION DOES NOT ADDRESS QUESTION---")
+            # 웹 검색 뒤에도 더 나은 답변이 없으면 이 답변으로 끝낸다
+            result["fallback"] = {"generation": generation, "documents": documents}
+        return result
 
     else:
         pprint("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS")
-        return {"hallucination": "Yes", "generation": "failed: hallucination", "hallucination_check_count": hallucination_check_count + 1, "documents": documents}
+        return {"hallucination": "Yes", "useful": useful, "generation": "failed: hallucination", "hallucination_check_count": hallucination_check_count + 1, "documents": documents, "hallucination_grades": stored}
 
+def keep_answer(state):
+    """
+    Fall back to the grounded answer kept before the web search
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): generation and documents restored from fallback, marked as not useful
+    """
+
+    print("---KEEP GROUNDED ANSWER FROM BEFORE WEB SEARCH---")
+    fallback = state["fallback"]
+    return {"generation": fallback["generation"], "documents": fallback["documents"], "hallucination": "No", "useful": "No"}
+
+async def akeep_answer(state):
+    """
+    Async variant of keep_answer
+    """
+    return keep_answer(state)
 
 ### Edges
 
@@ -194,66 +614,96 @@ def decide_to_generate(state):
     print("---ASSESS GRADED DOCUMENTS---")
     state["question"]
     web_search = state["web_search"]
-    state["documents"]
+    documents = state["documents"]
 
-    if web_search == "No":
+    if web_search == "No" and documents:
         # We have relevant documents, so generate answer
         print("---DECISION: GENERATE---")
         return "generate"
-    elif web_search == "Yes" and state["web_search_count"] == 0:
+    elif state["web_search_count"] == 0:
+        # 웹 검색 circuit이 열려 있으면 기다리지 않고 남은 관련 문서로 답변한다
+        if not _web_search_available(state):
+            if documents:
+                print("---DECISION: WEB SEARCH UNAVAILABLE, GENERATE FROM RETRIEVED DOCUMENTS---")
+                return "generate"
+            print("---DECISION: WEB SEARCH UNAVAILABLE, NO RELEVANT DOCUMENTS---")
+            return "not relevant"
         # All documents have been filtered check_relevance
         # We will re-generate a new query
         print(
             "---DECISION: ALL DOCUMENTS ARE NOT RELEVANT TO QUESTION, INCLUDE WEB SEARCH---"
         )
         return "websearch"
+    elif documents:
+        # 웹 검색 뒤에는 관련 없는 문서가 섞여 있었어도 걸러진 문서로 답변한다
+        print("---DECISION: GENERATE FROM RELEVANT DOCUMENTS AFTER WEB SEARCH---")
+        return "generate"
+    elif state.get("fallback"):
+        # 웹 검색으로도 관련 문서를 찾지 못하면 이전의 근거 있는 답변을 쓴다
+        print("---DECISION: NO BETTER DOCUMENTS, KEEP GROUNDED ANSWER---")
+        return "keep answer"
     else:
+        # 웹 검색이 실패해 남은 문서가 없을 때도 빈 context로 generate하지 않는다
+        print("---DECISION: NO RELEVANT DOCUMENTS---")
         return "not relevant"
 
 def decide_to_hallucination_check(state):
     """
-    Determines whether to re-generate an answer, or finish
+    Determines whether to re-generate an answer, search the web for more context, or finish
 
     Args:
         state (dict): The current graph state
 
     Returns:
-        str: Binary decision for next node to call
+        str: Decision for next node to call
     """
 
     print("---DECISION HALLUCINATION CHECK---")
     hallucination_check_count = state["hallucination_check_count"]
     hallucination = state["hallucination"]
     if hallucination_check_count > 1:
+        # 웹 검색 뒤 다시 만든 답변이 근거 없으면 이전의 근거 있는 답변을 쓴다
+        if hallucination == "Yes" and state.get("fallback"):
+            return "keep answer"
         return "over limit"
     elif hallucination == "Yes":
         return "generate"
+    elif (state.get("useful") == "No" and state.get("web_search_count", 0) == 0
+          and resources.get("web_search").available(state["question"])):
+        # 근거는 있지만 질문을 해결하지 못하면 웹 검색 결과를 더해 다시 생성
+        print("---DECISION: ANSWER NOT USEFUL, INCLUDE WEB SEARCH---")
+        return "not useful"
     else:
         return "not hallucination"
 
 workflow = StateGraph(GraphState)
 
 # Define the nodes
-workflow.add_node("websearch", web_search)  # web search
-workflow.add_node("retrieve", retrieve)  # retrieve
-workflow.add_node("grade_documents", grade_documents)  # grade documents
-workflow.add_node("generate", generate)  # generatae
-workflow.add_node("hallucination_check", hallucination_check)  # hallucination check
+# 각 노드는 동기/비동기 구현을 함께 가지므로 invoke/stream과 ainvoke/astream 모두 사용할 수 있다
+workflow.add_node("websearch", RunnableLambda(web_search, afunc=aweb_search))  # web search
+workflow.add_node("retrieve", RunnableLambda(retrieve, afunc=aretrieve))  # retrieve
+workflow.add_node("grade_documents", RunnableLambda(grade_documents, afunc=agrade_documents))  # grade documents
+workflow.add_node("generate", RunnableLambda(generate, afunc=agenerate))  # generatae
+workflow.add_node("hallucination_check", RunnableLambda(hallucination_check, afunc=ahallucination_check))  # hallucination check
+workflow.add_node("keep_answer", RunnableLambda(keep_answer, afunc=akeep_answer))  # fall back to the grounded answer
 
 workflow.add_edge(START, "retrieve")
 workflow.add_edge("retrieve", "grade_documents")
 workflow.add_conditional_edges(
     "grade_documents",
     decide_to_generate,
-    {"websearch": "websearch", "generate": "generate", "not relevant": END},
+    {"websearch": "websearch", "generate": "generate", "keep answer": "keep_answer", "not relevant": END},
 )
 workflow.add_edge("websearch", "grade_documents")
 workflow.add_edge("generate", "hallucination_check")
+workflow.add_edge("keep_answer", END)
 workflow.add_conditional_edges(
     "hallucination_check",
     decide_to_hallucination_check,
     {
         "generate": "generate",
+        "not useful": "websearch",
+        "keep answer": "keep_answer",
         "over limit": END,
         "not hallucination": END,
     },
@@ -1,73 +1,595 @@
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
 import bs4
-from langchain_community.document_loaders import WebBaseLoader
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 import requests
+from requests.adapters import HTTPAdapter
+
+from grade_policy import SCORE_SPACE
+from keyword_index import BM25Index
+from near_duplicates import SimHashIndex, mmr, simhash
+from resilience import dependencies
+
+# 벡터스토어를 디스크에 저장해 두고 다음 실행 때 그대로 연다
+PERSIST_DIRECTORY = os.environ.get(
+    "WEB_RETRIEVER_PERSIST_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "chroma_db"),
+)
+COLLECTION_NAME = "web_retriever"
+MANIFEST_FILE = "manifest.json"
+HTTP_CACHE_DIRECTORY = "http_cache"
+# 본문으로 쓰는 section의 class (beautifulsoup4 4.12 ~ 4.15에서 같은 결과를 내는지 확인함)
+POST_CLASSES = ("post-content", "post-title", "post-header")
+EMBEDDING_MODEL = "text-embedding-3-small"
+# 이 시간이 지난 출처는 다시 요청해 본다 (바뀌지 않았으면 304로 끝난다), 0이면 refresh=True일 때만
+REFRESH_INTERVAL = int(os.environ.get("WEB_RETRIEVER_REFRESH_INTERVAL", 24 * 60 * 60))
+
+URL_LIST = [
+    "https://lilianweng.github.io/posts/2023-06-23-agent/",
+    "https://lilianweng.github.io/posts/2023-03-15-prompt-engineering/",
+    "https://lilianweng.github.io/posts/2023-10-25-adv-attack-llm/",
+]
+RETRIEVER_KWARGS = {"search_type": "similarity", "search_kwargs": {'k': 6}}
+
+# BM25 + vector 검색 결과를 reciprocal rank fusion으로 합친다
+HYBRID_SEARCH = True
+HYBRID_FETCH_K = 20
+RRF_K = 60
+# 후보를 MMR로 다시 골라 거의 같은 chunk가 k개 자리를 차지하지 않게 한다 (None이면 끔)
+MMR_LAMBDA = 0.7
+
+SPLITTER_SETTINGS = {
+    "separators": ["\n\n", "\n\n\n"],
+    "chunk_size": 2000,
+    "chunk_overlap": 200,
+}
+
+# 수집 파이프라인 설정: 가져오는 중인 페이지는 FETCH_CONCURRENCY개, 임베딩 대기 chunk는 batch 하나까지만 둔다
+# (키워드 인덱스는 모든 chunk 본문을 메모리에 두고 저장할 때마다 전체를 다시 쓴다)
+FETCH_CONCURRENCY = 8
+EMBED_BATCH_SIZE = 256
+# manifest와 키워드 인덱스는 이만큼의 batch마다 저장한다
+COMMIT_EVERY_BATCHES = 8
+
+def post_sections(soup):
+    # 본문 class를 가진 tag 중 가장 바깥 것만 골라 중첩된 부분이 두 번 들어가지 않게 한다
+    # (SoupStrainer에 함수를 넘기면 bs4 4.13부터 tag 이름만 받아 본문이 모두 빠진다)
+    sections = soup.find_all(class_=POST_CLASSES)
+    matched = set(map(id, sections))
+    return [tag for tag in sections if not any(id(parent) in matched for parent in tag.parents)]
+
+class HttpCache(object):
+    """
+    On-disk store of page bodies with their ETag/Last-Modified validators
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def put(self, url, response):
+        entry = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "body": response.text,
+        }
+        if not entry["etag"] and not entry["last_modified"]:
+            return
+        tmp_path = self._path(url) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(url))
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
 
 class webRetriever(object):
-    def __init__(self, session):
+    def __init__(self, session, http_cache=None):
         self.session = session
-    
+        self.http_cache = http_cache
+        self.text_splitter = RecursiveCharacterTextSplitter(**SPLITTER_SETTINGS, length_function=len,
+                                                            is_separator_regex=False)
+
+    def fetch(self, url):
+        # 캐시된 validator로 조건부 요청, 304면 저장된 본문을 사용
+        cached = self.http_cache.get(url) if self.http_cache else None
+        headers = self.http_cache.conditional_headers(cached) if cached else {}
+        response = dependencies["web"].call(self._get, url, headers, rate_key=urlparse(url).netloc)
+        if response.status_code == 304 and cached:
+            return cached["body"]
+        response.raise_for_status()
+        if self.http_cache:
+            self.http_cache.put(url, response)
+        return response.text
+
+    def _get(self, url, headers):
+        response = self.session.get(url, headers=headers, timeout=dependencies["web"].timeout)
+        # 429와 5xx는 예외로 바꿔 재시도한다
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
     def read_web(self, url):
-        response = requests.get(url)
-        soup = bs4.BeautifulSoup(response.text, 'html.parser')
-        title = soup.find('title').text
-        loader = WebBaseLoader(
-            web_paths=(url,),
-            session=self.session,
-            bs_kwargs=dict(
-                parse_only=bs4.SoupStrainer(
-                    class_=("post-content", "post-title", "post-header")
-                )
-            ),
-        )
-        docs = loader.load()
-        
+        # 한 번만 받아서 title과 본문을 한 번의 파싱으로 추출한다
+        html = self.fetch(url)
+        soup = bs4.BeautifulSoup(html, 'html.parser')
+        title_tag = soup.find('title')
+        title = title_tag.text if title_tag else url
+        text = "".join(section.get_text() for section in post_sections(soup))
+        docs = [Document(page_content=text, metadata={"source": url, "title": title})]
+
         return docs, title
-    
+
+    def iter_splits(self, docs, url, title):
+        # chunk를 하나씩 만들어 넘기므로 페이지의 split 목록 전체를 들고 있지 않는다
+        for doc in docs:
+            for text in self.text_splitter.split_text(doc.page_content):
+                yield Document(page_content=text, metadata=dict(doc.metadata, url=url, title=title))
+
     def split_text(self, docs, url, title):
-        text_splitter = RecursiveCharacterTextSplitter(separators=["\n\n", "\n\n\n"],chunk_size=2000, chunk_overlap=200, length_function=len,
-                                                       is_separator_regex=False)
-        splits = text_splitter.split_documents(docs)
+        return list(self.iter_splits(docs, url, title))
+
+def iter_pages(web_retriever, urls, max_in_flight=FETCH_CONCURRENCY):
+    """
+    Fetch urls concurrently and yield (url, docs, title) as pages arrive
+
+    At most max_in_flight pages are being fetched or waiting to be consumed; the next
+    fetch is only submitted when the consumer asks for another page, so a slow consumer
+    (embedding) holds fetching back instead of the corpus piling up in memory. Failed
+    fetches are reported and skipped.
+    """
+    urls = iter(urls)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        def submit():
+            url = next(urls, None)
+            if url is not None:
+                in_flight[pool.submit(web_retriever.read_web, url)] = url
+
+        for _ in range(max_in_flight):
+            submit()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = in_flight.pop(future)
+                try:
+                    docs, title = future.result()
+                except Exception as e:
+                    # 실패한 출처는 기존 인덱스를 그대로 둔다
+                    print(f"---INGEST FAILED: {url} {e!r}---")
+                else:
+                    yield url, docs, title
+                submit()
+
+def index_key():
+    # splitter 설정, 임베딩 모델이나 본문 추출(bs4 버전)이 바뀌면 전체를 다시 임베딩해야 한다
+    settings = dict(SPLITTER_SETTINGS, embedding_model=EMBEDDING_MODEL, bs4=bs4.__version__, space=SCORE_SPACE)
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
 
-        for split in splits:
-            split.metadata["url"] = url
-            split.metadata["title"] = title
+def content_hash(docs, title):
+    digest = hashlib.sha256(title.encode("utf-8"))
+    for doc in docs:
+        digest.update(doc.page_content.encode("utf-8"))
+    return digest.hexdigest()
 
-        return splits
+def load_manifest(persist_directory=PERSIST_DIRECTORY):
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
 
-def insert_vectorstore(splits, vectorstore):
+def save_manifest(manifest, persist_directory=PERSIST_DIRECTORY):
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    # 중간에 죽어도 manifest가 깨지지 않도록 교체
+    os.replace(tmp_path, path)
+
+_corpus_versions = {}
+
+def corpus_version(persist_directory=PERSIST_DIRECTORY):
+    # manifest가 바뀌면(출처 추가/삭제, 내용 변경) 값이 바뀐다
+    # 답변 캐시가 요청마다 부르므로 파일이 그대로면 manifest를 다시 읽지 않는다
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    try:
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        stamp = None
+    cached = _corpus_versions.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    manifest = load_manifest(persist_directory)
+    items = sorted((url, e["content_hash"], e["index_key"]) for url, e in manifest.items())
+    version = hashlib.sha256(json.dumps(items).encode("utf-8")).hexdigest()
+    _corpus_versions[path] = (stamp, version)
+    return version
+
+def build_embeddings():
+    return OpenAIEmbeddings(model=EMBEDDING_MODEL)
+
+def load_vectorstore(persist_directory=PERSIST_DIRECTORY, embeddings=None):
+    os.makedirs(persist_directory, exist_ok=True)
+    # l2(기본값)는 relevance score가 [0, 1]을 벗어나므로 cosine 공간으로 만든다
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings or build_embeddings(),
+        persist_directory=persist_directory,
+        collection_metadata={"hnsw:space": SCORE_SPACE},
+    )
+
+def collection_space(vectorstore):
+    return (vectorstore._collection.metadata or {}).get("hnsw:space", "l2")
+
+def insert_vectorstore(splits, vectorstore, ids=None):
     # insert with title as metadata
     if vectorstore:
-        vectorstore.add_documents(splits)
+        vectorstore.add_documents(splits, ids=ids)
     else:
-        vectorstore = Chroma.from_documents(documents=splits, embedding=OpenAIEmbeddings(model="text-embedding-3-small"))
+        vectorstore = Chroma.from_documents(documents=splits, embedding=build_embeddings(), ids=ids)
 
     return vectorstore
-    
-def web_retrieve(url_list):
+
+def new_session(pool_size=FETCH_CONCURRENCY):
     session = requests.Session()
+    # 동시 요청 수만큼 커넥션을 재사용
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
     session.headers.update({
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
     })
-    web_retriever = webRetriever(session)
+    return session
 
-    docs = {}
-    vectorstore = None
-    for paths in url_list:
-        doc, title = web_retriever.read_web(paths)
-        splits = web_retriever.split_text(doc, paths, title)
-        if splits:
-            vectorstore = insert_vectorstore(splits, vectorstore)
+def chunk_id(url, digest, i):
+    prefix = hashlib.sha256(url.encode("utf-8")).hexdigest()[:8]
+    return f"{prefix}-{digest[:16]}-{i}"
+
+def chunk_ids(url, digest, count):
+    return [chunk_id(url, digest, i) for i in range(count)]
+
+def load_keyword_index(persist_directory=PERSIST_DIRECTORY):
+    return BM25Index.load(persist_directory)
+
+def add_manifest_fingerprints(near_index, manifest):
+    for url, entry in manifest.items():
+        for chunk, fingerprint in zip(entry["ids"], entry.get("fingerprints", [])):
+            near_index.add((url, chunk), int(fingerprint, 16))
+
+def load_near_index(vectorstore, persist_directory=PERSIST_DIRECTORY):
+    """
+    SimHash index of every stored chunk, so web results are checked against the corpus and earlier results
+
+    Returns:
+        SimHashIndex: fingerprints keyed on (url, chunk id)
+    """
+    near_index = SimHashIndex()
+    add_manifest_fingerprints(near_index, load_manifest(persist_directory))
+    stored = vectorstore.get(where={"origin": "web"}, include=["metadatas"])
+    for chunk, metadata in zip(stored["ids"], stored["metadatas"]):
+        fingerprint = (metadata or {}).get("fingerprint")
+        if fingerprint:
+            near_index.add((metadata.get("url"), chunk), int(fingerprint, 16))
+    return near_index
+
+def web_retrieve(url_list, persist_directory=PERSIST_DIRECTORY, refresh=False, embeddings=None, session=None,
+                 keyword_index=None, refresh_interval=REFRESH_INTERVAL):
+    """
+    Open the persisted vectorstore and index only the sources that are missing or changed
+
+    Fetching and embedding are streamed so the pages and chunks in flight are bounded
+    by the batch size, not the corpus: pages are fetched concurrently over one pooled
+    session (at most FETCH_CONCURRENCY ahead of the consumer), split lazily, and
+    embedded and written in batches of EMBED_BATCH_SIZE chunks across pages. The
+    keyword index is not bounded this way: BM25Index keeps the text of every chunk in
+    memory and each save rewrites the whole index, so a commit costs O(corpus). Chunks within NEAR_DUPLICATE_DISTANCE bits
+    (SimHash) of an indexed chunk are not embedded; a source that skipped chunks because
+    of another one is re-ingested when that source is removed or changed.
+    The manifest and keyword index are saved
+    every COMMIT_EVERY_BATCHES batches to keep that cost down; a page written to Chroma but not yet in the
+    manifest is re-ingested on the next run, which overwrites the same chunk ids.
+    Sources fetched more than refresh_interval seconds ago are fetched again with a
+    conditional request and re-embedded only when their content hash changed. The old
+    chunks of a changed source are deleted only after its new chunks are in the manifest;
+    ids left over by a crash in between are deleted on the next run.
+
+    Args:
+        url_list (list): URLs that make up the corpus
+        persist_directory (str): Directory holding the Chroma collection and manifest
+        refresh (bool): Re-fetch every indexed URL now, regardless of refresh_interval
+        embeddings (Embeddings): Embedding model, OpenAIEmbeddings by default
+        session (requests.Session): Session used for fetching, new_session() by default
+        keyword_index (BM25Index): Keyword index kept in sync with the vectorstore
+        refresh_interval (float): Seconds after which an indexed URL is fetched again, 0 to never
+
+    Returns:
+        Chroma: vectorstore containing every URL in url_list
+    """
+    vectorstore = load_vectorstore(persist_directory, embeddings)
+    if collection_space(vectorstore) != SCORE_SPACE:
+        # 거리 공간은 컬렉션을 만들 때만 정해지므로 다시 만든다 (index_key가 바뀌어 모든 출처를 다시 수집한다)
+        print(f"---INGEST: RECREATING THE COLLECTION IN {SCORE_SPACE} SPACE---")
+        vectorstore.delete_collection()
+        vectorstore = load_vectorstore(persist_directory, embeddings)
+    manifest = load_manifest(persist_directory)
+    key = index_key()
+
+    # 키워드 인덱스가 없던 시절에 만든 벡터스토어라면 저장된 chunk로 채운다 (컬렉션을 batch 단위로 읽는다)
+    if keyword_index is not None and not len(keyword_index) and manifest:
+        offset = 0
+        while True:
+            stored = vectorstore.get(include=["documents", "metadatas"], limit=EMBED_BATCH_SIZE, offset=offset)
+            if not stored["ids"]:
+                break
+            keyword_index.add(stored["ids"], [
+                Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(stored["documents"], stored["metadatas"])
+            ])
+            offset += len(stored["ids"])
+        keyword_index.save()
+
+    def drop_superseded():
+        # 새 chunk가 manifest에 기록된 뒤에야 이전 버전의 chunk를 지운다
+        superseded = [chunk for entry in manifest.values() for chunk in entry.pop("superseded", [])]
+        if not superseded:
+            return
+        vectorstore.delete(ids=superseded)
+        if keyword_index is not None:
+            keyword_index.remove(superseded)
+            keyword_index.save()
+        save_manifest(manifest, persist_directory)
+
+    # 이전 실행이 지우기 전에 멈췄다면 남은 chunk를 지운다
+    drop_superseded()
+
+    # 이미 저장된 chunk의 SimHash로 거의 같은 chunk를 다시 넣지 않는다
+    near_index = SimHashIndex()
+    add_manifest_fingerprints(near_index, manifest)
+
+    # 수집은 끝났지만 아직 manifest에 commit하지 않은 (url, entry)
+    finished = []
+
+    def forget(url):
+        entry = manifest.get(url) or {}
+        for chunk in entry.get("ids", []):
+            near_index.remove((url, chunk))
+        # 이 출처와 겹쳐서 건너뛴 chunk가 있는 출처는 다시 수집해야 한다 (아직 commit 전인 것 포함)
+        for other_entry in list(manifest.values()) + [entry for _, entry in finished]:
+            if url in other_entry.get("duplicate_of", []):
+                other_entry["content_hash"] = None
+
+    # url_list에서 빠진 출처는 인덱스에서도 제거
+    for url in list(manifest):
+        if url not in url_list:
+            forget(url)
+            removed_ids = manifest.pop(url)["ids"]
+            vectorstore.delete(ids=removed_ids)
+            if keyword_index is not None:
+                keyword_index.remove(removed_ids)
+                keyword_index.save()
+            save_manifest(manifest, persist_directory)
+
+    def is_current(url, digest=None):
+        # content_hash가 없으면 겹치던 출처가 바뀌어 다시 수집해야 하는 출처다
+        entry = manifest.get(url)
+        if not entry or entry["index_key"] != key or not entry.get("content_hash"):
+            return False
+        return digest is None or entry["content_hash"] == digest
+
+    def is_stale(url):
+        if refresh:
+            return True
+        fetched_at = manifest.get(url, {}).get("fetched_at")
+        return bool(refresh_interval) and (fetched_at is None or time.time() - fetched_at > refresh_interval)
+
+    targets = [url for url in dict.fromkeys(url_list) if not is_current(url) or is_stale(url)]
+    if not targets:
+        return vectorstore
+
+    web_retriever = webRetriever(session or new_session(), HttpCache(os.path.join(persist_directory, HTTP_CACHE_DIRECTORY)))
+    batch, batch_ids = [], []
+    flushed = 0
+
+    def commit():
+        # batch가 모두 기록된 페이지만 manifest에 올린다
+        if keyword_index is not None:
+            keyword_index.save()
+        for url, entry in finished:
+            manifest[url] = entry
+        finished.clear()
+        save_manifest(manifest, persist_directory)
+        drop_superseded()
+
+    def flush():
+        # 여러 페이지의 chunk를 모아 한 번에 임베딩하고 바로 기록
+        nonlocal flushed
+        if batch:
+            insert_vectorstore(batch, vectorstore, batch_ids)
+            if keyword_index is not None:
+                keyword_index.add(batch_ids, batch)
+            batch.clear()
+            batch_ids.clear()
+            flushed += 1
+            if flushed % COMMIT_EVERY_BATCHES == 0:
+                commit()
+
+    requeued = set()
+    while targets:
+        for url, docs, title in iter_pages(web_retriever, targets):
+            if not any(doc.page_content.strip() for doc in docs):
+                # 본문을 추출하지 못한 페이지를 최신으로 기록하면 다시 수집되지 않는다
+                print(f"---INGEST: NO TEXT EXTRACTED FROM {url}, KEEPING THE PREVIOUS INDEX---")
+                continue
+            digest = content_hash(docs, title)
+            if is_current(url, digest):
+                # 내용이 같으면 다시 임베딩하지 않고 확인한 시각만 남긴다
+                finished.append((url, dict(manifest[url], fetched_at=time.time())))
+                continue
+            old_ids = manifest.get(url, {}).get("ids", [])
+            if old_ids:
+                forget(url)
+            ids, fingerprints, duplicate_of, duplicates = [], [], set(), 0
+            for i, split in enumerate(web_retriever.iter_splits(docs, url, title)):
+                fingerprint = simhash(split.page_content)
+                if fingerprint is None:
+                    # 단어가 없는 chunk는 임베딩하지 않는다
+                    continue
+                duplicate = near_index.find(fingerprint)
+                if duplicate is not None:
+                    duplicates += 1
+                    if duplicate[0] != url:
+                        duplicate_of.add(duplicate[0])
+                    continue
+                ids.append(chunk_id(url, digest, i))
+                fingerprints.append(f"{fingerprint:016x}")
+                near_index.add((url, ids[-1]), fingerprint)
+                batch.append(split)
+                batch_ids.append(ids[-1])
+                if len(batch) >= EMBED_BATCH_SIZE:
+                    flush()
+            if duplicates:
+                print(f"---INGEST: SKIPPED {duplicates} NEAR-DUPLICATE CHUNKS FROM {url}---")
+            finished.append((url, {"content_hash": digest, "index_key": key, "title": title, "ids": ids,
+                                   "fingerprints": fingerprints, "duplicate_of": sorted(duplicate_of),
+                                   "fetched_at": time.time(),
+                                   "superseded": [chunk for chunk in old_ids if chunk not in ids]}))
+        flush()
+        commit()
+        # 이번 실행에서 바뀌거나 지워진 출처와 겹쳐 chunk를 건너뛴 출처는 바로 다시 수집한다
+        targets = [url for url in dict.fromkeys(url_list)
+                   if url in manifest and not manifest[url].get("content_hash") and url not in requeued]
+        requeued.update(targets)
 
     return vectorstore
 
-retriever = web_retrieve([
-        "https://lilianweng.github.io/posts/2023-06-23-agent/",
-        "https://lilianweng.github.io/posts/2023-03-15-prompt-engineering/",
-        "https://lilianweng.github.io/posts/2023-10-25-adv-attack-llm/",
-    ]).as_retriever(search_type="similarity", search_kwargs={'k': 6})
+def ingest_web_results(documents, vectorstore, keyword_index=None, near_index=None):
+    """
+    Add web search results to the local index so later questions find them without searching
+
+    The chunk id is derived from the content, so ingesting the same result again
+    overwrites it. Web results are not part of the manifest and survive URL_LIST changes.
+    Results without words, and results within NEAR_DUPLICATE_DISTANCE bits of a chunk in
+    near_index (see load_near_index), are not embedded.
+
+    Returns:
+        list: ids of the ingested chunks
+    """
+    splits, ids, keys, duplicates = [], [], [], 0
+    for doc in documents:
+        fingerprint = simhash(doc.page_content)
+        if fingerprint is None:
+            continue
+        if near_index is not None and near_index.find(fingerprint) is not None:
+            duplicates += 1
+            continue
+        url = doc.metadata.get("url") or ""
+        # Tavily score는 검색 점수와 척도가 달라 저장하지 않는다
+        splits.append(Document(page_content=doc.page_content, metadata={
+            "url": url, "title": doc.metadata.get("title") or url, "source": url, "origin": "web",
+            "fingerprint": f"{fingerprint:016x}",
+        }))
+        ids.append("web-" + hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()[:24])
+        if near_index is not None:
+            # 같은 검색 결과 안의 중복도 거른다
+            keys.append((url, ids[-1]))
+            near_index.add(keys[-1], fingerprint)
+    if duplicates:
+        print(f"---INGEST: SKIPPED {duplicates} NEAR-DUPLICATE WEB RESULTS---")
+    if not splits:
+        return []
+    try:
+        insert_vectorstore(splits, vectorstore, ids)
+    except Exception:
+        for key in keys:
+            near_index.remove(key)
+        raise
+    if keyword_index is not None:
+        keyword_index.add(ids, splits)
+        keyword_index.save()
+    return ids
+
+def _fusion_key(doc):
+    return doc.metadata.get("url"), doc.page_content
+
+class HybridRetriever(BaseRetriever):
+    """
+    Vector similarity and BM25 keyword search fused with reciprocal rank fusion
+
+    Every returned document carries metadata['score'], the vector relevance score in
+    [0, 1] (missing for chunks found only by keyword), and metadata['rrf_score'].
+    Without a keyword index it is a plain similarity search that still sets the score.
+    With mmr_lambda set, the k results are chosen from the fused candidates by maximal
+    marginal relevance so near-identical passages do not fill several slots.
+    """
+
+    vectorstore: object
+    keyword_index: object = None
+    k: int = 6
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+    mmr_lambda: Optional[float] = MMR_LAMBDA
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        rerank = self.keyword_index is not None or self.mmr_lambda is not None
+        fetch_k = self.fetch_k if rerank else self.k
+        dense = self.vectorstore.similarity_search_with_relevance_scores(query, k=fetch_k)
+        relevance = {}
+        for doc, score in dense:
+            relevance[_fusion_key(doc)] = round(score, 4)
+        rankings = [[doc for doc, _ in dense]]
+        if self.keyword_index is not None:
+            rankings.append([doc for _, doc, _ in self.keyword_index.search(query, k=self.fetch_k)])
 
+        scores, documents = {}, {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking):
+                key = _fusion_key(doc)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+                documents.setdefault(key, doc)
+        ranked = sorted(scores, key=lambda key: -scores[key])
+        if self.mmr_lambda is not None:
+            selected = mmr([documents[key] for key in ranked], [scores[key] for key in ranked], self.k, self.mmr_lambda)
+            ranked = [ranked[i] for i in selected]
+        ranked = ranked[:self.k]
 
+        results = []
+        for key in ranked:
+            # 키워드 인덱스의 Document를 그대로 반환하지 않도록 복사
+            doc = Document(page_content=documents[key].page_content, metadata=dict(documents[key].metadata))
+            if key in relevance:
+                doc.metadata["score"] = relevance[key]
+            doc.metadata["rrf_score"] = round(scores[key], 6)
+            results.append(doc)
+        return results
 
+def build_retriever(vectorstore, keyword_index=None):
+    return HybridRetriever(vectorstore=vectorstore, keyword_index=keyword_index if HYBRID_SEARCH else None,
+                           k=RETRIEVER_KWARGS["search_kwargs"]["k"])